@@ -46,6 +46,10 @@ class Config:
     CLIENT_ID = config.get("CLIENT_ID")
     CLIENT_SECRET = config.get("CLIENT_SECRET")
     LOCATION_DROP_LIST = config.get("LOCATION_DROP_LIST")
+    # Locations fetched concurrently
+    TOAST_MAX_WORKERS = int(config.get("TOAST_MAX_WORKERS", 4))
+    # Retries for 429 / 5xx responses before the request is failed
+    TOAST_MAX_RETRIES = int(config.get("TOAST_MAX_RETRIES", 5))
 
     # R365 API configuration
     R365_BASE_URL = config.get("R365_BASE_URL")
@@ -53,6 +57,22 @@ class Config:
     R365_SECURITY_ID = config.get("R365_SECURITY_ID")
     R365_TENANT_ID = config.get("R365_TENANT_ID")
 
+    # ETag / Last-Modified validators for conditional catalog requests
+    R365_VALIDATOR_CACHE_FILE = config.get("R365_VALIDATOR_CACHE_FILE")
+    if not R365_VALIDATOR_CACHE_FILE:
+        R365_VALIDATOR_CACHE_FILE = PROJECT_ROOT / ".env" / "r365_validators.json"
+    else:
+        R365_VALIDATOR_CACHE_FILE = (
+            Path(R365_VALIDATOR_CACHE_FILE).expanduser().resolve()
+        )
+
+    # Last run of the incremental weekly item base cost refresh
+    BASE_COST_STATE_FILE = config.get("BASE_COST_STATE_FILE")
+    if not BASE_COST_STATE_FILE:
+        BASE_COST_STATE_FILE = PROJECT_ROOT / ".env" / "weekly_base_cost_state.json"
+    else:
+        BASE_COST_STATE_FILE = Path(BASE_COST_STATE_FILE).expanduser().resolve()
+
     MAIL_USER = config.get("EMAIL_USER")
     MAIL_PASS = config.get("EMAIL_PASS")
     MAIL_SERVER = config.get("EMAIL_SERVER")
@@ -1,4 +1,7 @@
+from io import StringIO
+
 import psycopg2
+from psycopg2 import sql
 from psycopg2.extras import DictCursor, execute_values
 from sqlalchemy import create_engine
 
@@ -45,6 +48,136 @@ class DatabaseConnection:
         execute_values(self.cur, query, records)
         self.conn.commit()
 
+    def copy_frame(self, df, table: str):
+        """
+        Bulk load a DataFrame into table with COPY ... FROM STDIN.
+
+        Columns are matched by name. Nothing is committed, so the load can be
+        staged into a temp table and merged in the same transaction.
+        """
+        buffer = StringIO()
+        df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        query = sql.SQL(
+            "COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)"
+        ).format(
+            table=sql.Identifier(table),
+            columns=sql.SQL(", ").join(map(sql.Identifier, df.columns)),
+        )
+        self.cur.copy_expert(query.as_string(self.cur), buffer)
+
+    def merge_frame(
+        self,
+        df,
+        table: str,
+        key: list,
+        update_columns: list = None,
+        now_columns: list = (),
+        commit: bool = True,
+    ) -> int:
+        """
+        Upsert a DataFrame into table with COPY and a single INSERT ... ON CONFLICT.
+
+        Rows are deduplicated on key (last one wins, since a key may only be
+        merged once per statement), COPY'd into a temp table shaped like
+        table that is dropped at commit, and merged on key. update_columns
+        defaults to every non-key column of df; now_columns are set to NOW()
+        on update. With commit=False the caller can add statements to the
+        same transaction and commits itself; on error the transaction is
+        rolled back. Returns the number of rows merged.
+        """
+        df = df.drop_duplicates(subset=key, keep="last")
+        columns = list(df.columns)
+        if update_columns is None:
+            update_columns = [c for c in columns if c not in key]
+        staging = f"temp_{table}"
+
+        assignments = [
+            sql.SQL("{col} = EXCLUDED.{col}").format(col=sql.Identifier(c))
+            for c in update_columns
+        ] + [sql.SQL("{} = NOW()").format(sql.Identifier(c)) for c in now_columns]
+        column_list = sql.SQL(", ").join(map(sql.Identifier, columns))
+
+        try:
+            self.cur.execute(
+                sql.SQL(
+                    """
+                    CREATE TEMP TABLE {staging} ON COMMIT DROP AS
+                    SELECT {columns} FROM {table} WITH NO DATA
+                    """
+                ).format(
+                    staging=sql.Identifier(staging),
+                    columns=column_list,
+                    table=sql.Identifier(table),
+                )
+            )
+            self.copy_frame(df, staging)
+            self.cur.execute(
+                sql.SQL(
+                    """
+                    INSERT INTO {table} ({columns})
+                    SELECT {columns} FROM {staging}
+                    ON CONFLICT ({key}) DO UPDATE
+                    SET {assignments}
+                    """
+                ).format(
+                    table=sql.Identifier(table),
+                    columns=column_list,
+                    staging=sql.Identifier(staging),
+                    key=sql.SQL(", ").join(map(sql.Identifier, key)),
+                    assignments=sql.SQL(", ").join(assignments),
+                )
+            )
+            if commit:
+                self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        return len(df)
+
+    def upsert_changed(self, table: str, columns: list, key: list, records: list):
+        """
+        Upsert records into table, rewriting only rows whose values changed.
+
+        Existing rows are updated only when a non-key column IS DISTINCT FROM
+        the incoming value, so unchanged rows produce no new tuple or WAL.
+        Returns (inserted, updated, unchanged) counts.
+        """
+        update_columns = [c for c in columns if c not in key]
+        query = sql.SQL(
+            """
+            INSERT INTO {table} ({columns})
+            VALUES %s
+            ON CONFLICT ({key}) DO UPDATE
+            SET {assignments}
+            WHERE ({current}) IS DISTINCT FROM ({incoming})
+            RETURNING (xmax = 0) AS inserted
+            """
+        ).format(
+            table=sql.Identifier(table),
+            columns=sql.SQL(", ").join(map(sql.Identifier, columns)),
+            key=sql.SQL(", ").join(map(sql.Identifier, key)),
+            assignments=sql.SQL(", ").join(
+                sql.SQL("{col} = EXCLUDED.{col}").format(col=sql.Identifier(c))
+                for c in update_columns
+            ),
+            current=sql.SQL(", ").join(
+                sql.Identifier(table, c) for c in update_columns
+            ),
+            incoming=sql.SQL(", ").join(
+                sql.SQL("EXCLUDED.{}").format(sql.Identifier(c))
+                for c in update_columns
+            ),
+        )
+        written = execute_values(self.cur, query, records, fetch=True)
+        self.conn.commit()
+
+        inserted = sum(1 for row in written if row[0])
+        updated = len(written) - inserted
+        unchanged = len(records) - len(written)
+        return inserted, updated, unchanged
+
     def rollback(self):
         """Rollback the current transaction."""
         if self.conn:
@@ -0,0 +1,452 @@
+"""
+Menu engineering metrics and Star / Puzzle / Opportunity / Dog classification.
+
+Column names differ between the Excel report and the menu_engineering table,
+so every function takes a column map; REPORT_COLUMNS and TABLE_COLUMNS cover
+the two layouts in use.
+"""
+
+import hashlib
+import logging
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+REPORT_COLUMNS = {
+    "qty": "Qty",
+    "price": "Price",
+    "cost": "Cost",
+    "cost_pct": "Cost %",
+    "margin": "Margin",
+    "total_cost": "Total Cost",
+    "profit": "Profit",
+    "rating": "rating",
+}
+
+TABLE_COLUMNS = {
+    "qty": "quantity",
+    "price": "menu_price",
+    "cost": "menu_cost",
+    "cost_pct": "cost_pct",
+    "margin": "margin",
+    "total_cost": "total_cost",
+    "profit": "profit",
+    "rating": "rating",
+}
+
+
+def add_metrics(df, columns=TABLE_COLUMNS):
+    """Add cost %, margin, total cost and profit columns to df in place."""
+    qty = df[columns["qty"]].to_numpy(dtype=float)
+    price = df[columns["price"]].to_numpy(dtype=float)
+    cost = df[columns["cost"]].to_numpy(dtype=float)
+
+    # Items without a price have no meaningful cost %, report them as 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cost_pct = np.where(price != 0, cost / price, 0.0)
+    margin = price - cost
+
+    df[columns["cost_pct"]] = cost_pct
+    df[columns["margin"]] = margin
+    df[columns["total_cost"]] = qty * cost
+    df[columns["profit"]] = qty * margin
+    return df
+
+
+def classify(df, group_cols, columns=TABLE_COLUMNS):
+    """
+    Rate every item against the means of its group.
+
+    Quantity and margin means come from one groupby-transform over
+    group_cols (e.g. store and category), so all groups are rated in a
+    single pass. Items at or above both means are Stars, popular low-margin
+    items Opportunities, unpopular high-margin items Puzzles, the rest Dogs.
+    """
+    groups = df.groupby(group_cols, dropna=False, sort=False)
+    qty = df[columns["qty"]]
+    margin = df[columns["margin"]]
+
+    high_qty = ~(qty < groups[columns["qty"]].transform("mean"))
+    high_margin = ~(margin < groups[columns["margin"]].transform("mean"))
+
+    df[columns["rating"]] = np.select(
+        [high_qty & high_margin, high_qty, high_margin],
+        ["Star", "Opportunity", "Puzzle"],
+        default="Dog",
+    )
+    return df
+
+
+CURRENCY_COLUMNS = {"Price", "Cost", "Margin", "Sales", "Total Cost", "Profit"}
+PERCENT_COLUMNS = {"Cost %"}
+
+
+def column_width(df, column):
+    longest = df[column].astype(str).str.len().max() if len(df) else 0
+    longest = max(len(str(column)), longest)
+    return (longest + 2) * 1.2
+
+
+def write_store_workbook(path, sheets):
+    """
+    Write one store's report, one sheet per (name, DataFrame) in sheets.
+
+    Uses xlsxwriter in constant-memory mode, so rows are streamed to disk as
+    they are written. Number formats and column widths are set here; the
+    workbook needs no second formatting pass. Runs in a worker process, so
+    it only takes picklable arguments.
+    """
+    workbook = xlsxwriter.Workbook(
+        str(path), {"constant_memory": True, "nan_inf_to_errors": True}
+    )
+    header_format = workbook.add_format({"bold": True, "border": 1})
+    currency_format = workbook.add_format({"num_format": "#,##0.00"})
+    percent_format = workbook.add_format({"num_format": "0.0%"})
+
+    try:
+        for sheet_name, df in sheets:
+            worksheet = workbook.add_worksheet(sheet_name)
+
+            formats = []
+            for col, column in enumerate(df.columns):
+                if column in PERCENT_COLUMNS:
+                    cell_format = percent_format
+                elif column in CURRENCY_COLUMNS:
+                    cell_format = currency_format
+                else:
+                    cell_format = None
+                formats.append(cell_format)
+                worksheet.set_column(col, col, column_width(df, column), cell_format)
+                worksheet.write_string(0, col, str(column), header_format)
+
+            for row, values in enumerate(df.itertuples(index=False), start=1):
+                for col, value in enumerate(values):
+                    if pd.isna(value):
+                        continue
+                    if isinstance(value, (int, float, np.number)):
+                        worksheet.write_number(row, col, value, formats[col])
+                    else:
+                        worksheet.write_string(row, col, str(value), formats[col])
+    finally:
+        workbook.close()
+
+    return path
+
+
+# Weekly product mix per store and item, priced from toast_product_mix and
+# costed from the store's recipe_cost row as of each week's end (menu_cost,
+# null when recipe_cost has no row that old) and its latest row
+# (latest_cost). Toast items share no
+# id with R365, so each item name is matched once against pre-aggregated
+# recipe_cost and menu_items lookups; from there concept and categories
+# follow the (concept, menu_item) key. Items with no recipe or menu_items
+# row take the restaurant's concept.
+MENU_MIX_QUERY = """
+    WITH weekly_mix AS (
+        SELECT
+            pm.store_id,
+            c.year,
+            c.period,
+            c.week,
+            c.week_start,
+            c.week_end,
+            pm.item_name AS menu_item,
+            SUM(pm.qty_sold) AS quantity,
+            COALESCE(
+                SUM(pm.qty_sold * pm.menu_item_price) / NULLIF(SUM(pm.qty_sold), 0),
+                0
+            ) AS menu_price,
+            SUM(pm.gross_item_amt) AS sales
+        FROM toast_product_mix pm
+        JOIN calendar c ON c.date = pm.date
+        WHERE pm.date BETWEEN %(start_date)s AND %(end_date)s
+        GROUP BY
+            pm.store_id,
+            c.year,
+            c.period,
+            c.week,
+            c.week_start,
+            c.week_end,
+            pm.item_name
+    ),
+    week_cost AS (
+        SELECT DISTINCT ON (m.store_id, m.menu_item, m.week_end)
+            m.store_id,
+            m.menu_item,
+            m.week_end,
+            rc.recipe_cost
+        FROM weekly_mix m
+        JOIN recipe_cost rc
+            ON rc.id = m.store_id
+            AND rc.menu_item = m.menu_item
+            AND rc.date <= m.week_end
+        ORDER BY m.store_id, m.menu_item, m.week_end, rc.date DESC
+    ),
+    item_cost AS (
+        SELECT DISTINCT ON (id, menu_item)
+            id AS store_id,
+            menu_item,
+            concept,
+            recipe_cost
+        FROM recipe_cost
+        ORDER BY id, menu_item, date DESC
+    ),
+    menu_category AS (
+        SELECT DISTINCT ON (menu_item, concept)
+            menu_item,
+            concept,
+            category_1,
+            category_2,
+            category_3
+        FROM menu_items
+        ORDER BY menu_item, concept, category_2_sort
+    ),
+    item_category AS (
+        SELECT DISTINCT ON (menu_item) *
+        FROM menu_category
+        ORDER BY menu_item, concept
+    )
+    SELECT
+        r.name AS location,
+        m.store_id,
+        m.week_start AS date,
+        m.year,
+        m.period,
+        m.week,
+        m.week_end,
+        COALESCE(ic.concept, cat.concept, anycat.concept, r.concept) AS concept,
+        m.menu_item,
+        m.quantity,
+        m.menu_price,
+        wc.recipe_cost AS menu_cost,
+        ic.recipe_cost AS latest_cost,
+        m.sales,
+        COALESCE(cat.category_1, anycat.category_1) AS category1,
+        COALESCE(cat.category_2, anycat.category_2) AS category2,
+        COALESCE(cat.category_3, anycat.category_3) AS category3
+    FROM weekly_mix m
+    JOIN restaurants r ON r.id = m.store_id
+    LEFT JOIN week_cost wc
+        ON wc.store_id = m.store_id
+        AND wc.menu_item = m.menu_item
+        AND wc.week_end = m.week_end
+    LEFT JOIN item_cost ic
+        ON ic.store_id = m.store_id AND ic.menu_item = m.menu_item
+    LEFT JOIN menu_category cat
+        ON cat.menu_item = m.menu_item
+        AND cat.concept = COALESCE(ic.concept, r.concept)
+    LEFT JOIN item_category anycat ON anycat.menu_item = m.menu_item
+    ORDER BY r.name, m.year, m.period, m.week, m.menu_item
+"""
+
+
+def get_week_dates(db, year, period, week):
+    """Return (week_start, week_end) for a fiscal week."""
+    db.cur.execute(
+        """
+        SELECT week_start, week_end
+        FROM calendar
+        WHERE year = %s AND period = %s AND week = %s
+        LIMIT 1
+        """,
+        (year, period, week),
+    )
+    result = db.cur.fetchone()
+    if not result:
+        raise ValueError(
+            f"No calendar entry for year={year}, period={period}, week={week}"
+        )
+    return result["week_start"], result["week_end"]
+
+
+def get_week_range(db, start_date, end_date):
+    """Widen a date range to whole fiscal weeks: (first week_start, last week_end)."""
+    db.cur.execute(
+        """
+        SELECT MIN(week_start) AS week_start, MAX(week_end) AS week_end
+        FROM calendar
+        WHERE date BETWEEN %s AND %s
+        """,
+        (start_date, end_date),
+    )
+    result = db.cur.fetchone()
+    if not result or result["week_start"] is None:
+        raise ValueError(f"No calendar entries between {start_date} and {end_date}")
+    return result["week_start"], result["week_end"]
+
+
+def get_menu_mix(db, start_date, end_date):
+    """
+    Weekly menu mix for every store between start_date and end_date.
+
+    All aggregation and joins run in the database; one row comes back per
+    store, fiscal week and menu item, in the TABLE_COLUMNS layout. Items
+    missing from menu_items have null categories and are logged. menu_cost
+    is the cost as of the week's end and may be null; see resolve_costs.
+    """
+    db.cur.execute(MENU_MIX_QUERY, {"start_date": start_date, "end_date": end_date})
+    columns = [desc[0] for desc in db.cur.description]
+    df = pd.DataFrame(db.cur.fetchall(), columns=columns)
+
+    numeric = ["quantity", "menu_price", "menu_cost", "latest_cost", "sales"]
+    df[numeric] = df[numeric].astype(float)
+
+    unmatched = df.loc[df["category1"].isna(), "menu_item"].unique()
+    if len(unmatched):
+        logging.warning(
+            f"{len(unmatched)} product mix items not in menu_items: "
+            + ", ".join(sorted(unmatched)[:20])
+        )
+    return df
+
+
+def resolve_costs(df):
+    """
+    Fill menu_cost from latest_cost where no cost was known as of the week.
+
+    Callers that can do better, such as keeping a cost already stored for
+    the week, fill menu_cost before calling this. latest_cost is dropped.
+    """
+    df["menu_cost"] = df["menu_cost"].fillna(df["latest_cost"])
+    return df.drop(columns="latest_cost")
+
+
+def frame_fingerprint(df, salt=""):
+    """
+    Content hash of a DataFrame, independent of row order.
+
+    Rows are hashed with pandas, the row hashes sorted and digested together
+    with the column names, so the same inputs give the same fingerprint.
+    salt folds in inputs that live outside the frame.
+    """
+    row_hashes = np.sort(pd.util.hash_pandas_object(df, index=False).to_numpy())
+    digest = hashlib.sha256("\x1f".join(map(str, df.columns)).encode())
+    digest.update(row_hashes.tobytes())
+    digest.update(salt.encode())
+    return digest.hexdigest()
+
+
+# Stores that serve a bread basket, keyed by store id, with the cost per
+# basket used when recipe_cost has no bread basket recipe for the store
+BREAD_BASKET_FALLBACK_COSTS = {4: 0.19, 9: 0.19, 11: 0.84, 15: 0.96, 16: 0.69, 17: 0.84}
+
+# Bread basket cost per entree used by the Excel report built from the R365
+# CSV exports, keyed by the report's store name
+REPORT_BREAD_BASKET_COSTS = {
+    "CHOPHOUSE-NOLA": 0.35,
+    "CHOPHOUSE '47": 0.35,
+    "GULFSTREAM CAFE": 0.92,
+    "NEW YORK PRIME-MYRTLE BEACH": 0.79,
+    "NEW YORK PRIME-BOCA": 0.85,
+    "NEW YORK PRIME-ATLANTA": 0.83,
+}
+BREAD_BASKET_ITEM = "Bread Basket per Entree"
+
+BREAD_BASKET_QUERY = """
+    SELECT
+        f.store_id,
+        w.as_of,
+        bb.recipe_cost AS menu_cost,
+        COALESCE(latest.recipe_cost, f.cost) AS latest_cost
+    FROM unnest(%(store_ids)s::integer[], %(costs)s::double precision[])
+        AS f(store_id, cost)
+    CROSS JOIN unnest(%(as_of)s::date[]) AS w(as_of)
+    LEFT JOIN LATERAL (
+        SELECT rc.recipe_cost
+        FROM recipe_cost rc
+        WHERE rc.id = f.store_id
+            AND rc.menu_item ~* 'Bread.*Basket'
+            AND (w.as_of IS NULL OR rc.date <= w.as_of)
+        ORDER BY rc.date DESC
+        LIMIT 1
+    ) bb ON true
+    LEFT JOIN LATERAL (
+        SELECT rc.recipe_cost
+        FROM recipe_cost rc
+        WHERE rc.id = f.store_id AND rc.menu_item ~* 'Bread.*Basket'
+        ORDER BY rc.date DESC
+        LIMIT 1
+    ) latest ON true
+"""
+
+
+def get_bread_basket_costs(
+    db, as_of=(None,), fallback_costs=BREAD_BASKET_FALLBACK_COSTS
+):
+    """
+    Bread basket cost for every bread store and as-of date, from one query.
+
+    menu_cost is the store's bread basket recipe cost as of each date (None
+    means the latest), null when there is none; latest_cost is the latest
+    recipe cost, else the fallback cost.
+    """
+    db.cur.execute(
+        BREAD_BASKET_QUERY,
+        {
+            "store_ids": list(fallback_costs),
+            "costs": list(fallback_costs.values()),
+            "as_of": list(as_of),
+        },
+    )
+    return pd.DataFrame(
+        db.cur.fetchall(), columns=["store_id", "as_of", "menu_cost", "latest_cost"]
+    ).astype({"menu_cost": float, "latest_cost": float})
+
+
+def add_bread_basket(df, db, group_cols=("store_id",), as_of_col=None):
+    """
+    Append a no-charge "Bread Basket per Entree" row for each bread store.
+
+    df is in the TABLE_COLUMNS layout with store_id and location columns.
+    The basket quantity is the group's entree count, so group_cols can
+    include week columns to add one row per store and week. With as_of_col
+    (one of group_cols, e.g. week_end) each row is costed as of that date;
+    like get_menu_mix, rows carry menu_cost and latest_cost for
+    resolve_costs. Each row keeps the location name its store has in df.
+    All rows are built at once and appended with a single concat.
+    """
+    if as_of_col is None:
+        costs = get_bread_basket_costs(db).drop(columns="as_of")
+        cost_keys = ["store_id"]
+    else:
+        costs = get_bread_basket_costs(db, sorted(df[as_of_col].dropna().unique()))
+        costs = costs.rename(columns={"as_of": as_of_col})
+        cost_keys = ["store_id", as_of_col]
+
+    return pd.concat(
+        [df, bread_basket_rows(df, costs, group_cols, cost_keys)], ignore_index=True
+    )
+
+
+def bread_basket_rows(df, costs, group_cols, cost_keys):
+    """
+    No-charge bread basket rows for the groups of df that have a cost.
+
+    costs holds menu_cost (and any other cost columns) keyed by cost_keys,
+    which must be among group_cols; quantity is each group's entree count.
+    """
+    group_cols = list(group_cols)
+    columns = list(dict.fromkeys(group_cols + ["location"]))
+    groups = df.loc[
+        df[cost_keys[0]].isin(costs[cost_keys[0]]), columns
+    ].drop_duplicates(group_cols)
+    entrees = (
+        df[df["category2"] == "Entree"]
+        .groupby(group_cols, as_index=False)["quantity"]
+        .sum()
+    )
+    return (
+        groups.merge(costs, on=cost_keys)
+        .merge(entrees, on=group_cols, how="left")
+        .fillna({"quantity": 0})
+        .assign(
+            concept="Steakhouse",
+            menu_item=BREAD_BASKET_ITEM,
+            menu_price=0.0,
+            sales=0.0,
+            category1="Food",
+            category2="No Charge",
+            category3="None",
+        )
+    )
@@ -0,0 +1,139 @@
+import os
+import re
+from functools import lru_cache
+
+import pandas as pd
+
+
+class PrefixIndex:
+    """
+    Word-level trie of size-priced parent item names.
+
+    Toast sells size-priced items as "<parent> <size>" (e.g. "Filet 8oz"),
+    where the parent is a name recorded as part A. resolve() finds the
+    longest parent that prefixes a name at a word boundary in a single walk
+    over the name's words, independent of how many parents are indexed.
+    """
+
+    _END = object()
+
+    def __init__(self, names=()):
+        self.root = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        node = self.root
+        for word in name.split(" "):
+            node = node.setdefault(word, {})
+        node[self._END] = True
+
+    def longest_prefix(self, name):
+        """Return the number of words in the longest indexed parent of name."""
+        words = name.split(" ")
+        node = self.root
+        match = 0
+        # A parent only matches when at least one word follows it
+        for depth, word in enumerate(words[:-1], start=1):
+            node = node.get(word)
+            if node is None:
+                break
+            if self._END in node:
+                match = depth
+        return match
+
+    def resolve(self, name):
+        """Strip the longest parent prefix from name, leaving part B."""
+        match = self.longest_prefix(name)
+        if not match:
+            return name
+        return " ".join(name.split(" ")[match:]).strip()
+
+    def resolve_series(self, names):
+        """Vectorized resolve(); each distinct name is resolved only once."""
+        unique = pd.unique(names)
+        return names.map({name: self.resolve(name) for name in unique})
+
+
+SPECIALTY_FILE = "./specialty.txt"
+
+# Toast modifiers, service lines and other non-menu items
+DEFAULT_EXCLUDE_PATTERNS = (
+    r"^No ",
+    r" Only$",
+    r" Tax$",
+    r"^& ",
+    r"^Seat ",
+    r"Allergy$",
+    r"Outstanding$",
+    r"for Salad",
+    r"for Steak",
+    r"for Sand",
+    r"for Taco",
+    r"for Cali-Club",
+    r"for Edge",
+    r"See Server",
+    r"Refund",
+    r"2 Pens",
+)
+
+PRE_MODS = ("Add", "Extra", "Lite", "On Side")
+POST_MODS = ("On Side", "Only")
+PRE_MOD_RE = re.compile(r"^(" + "|".join(PRE_MODS) + r")\s+")
+POST_MOD_RE = re.compile(r"\s+(" + "|".join(POST_MODS) + r")$")
+
+_specialty_cache = {}
+
+
+def load_specialty_names(path=SPECIALTY_FILE):
+    """Exact names from the specialty file, re-read only when its mtime changes."""
+    try:
+        mtime = os.path.getmtime(path)
+    except FileNotFoundError:
+        return frozenset()
+
+    cached = _specialty_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path) as file:
+        names = frozenset(line.strip() for line in file if line.strip())
+    _specialty_cache[path] = (mtime, names)
+    return names
+
+
+@lru_cache(maxsize=None)
+def compile_patterns(patterns):
+    return re.compile("|".join(f"(?:{pat})" for pat in patterns))
+
+
+class ExclusionFilter:
+    """
+    Decides which menu item names are not real menu items.
+
+    A name is excluded when it is listed in the specialty file or matches one
+    of the patterns. The file is hashed into a set and the patterns are
+    compiled into one regex, both shared across every filter in the process.
+    Scripts with their own exclusion rules pass their pattern list in place
+    of DEFAULT_EXCLUDE_PATTERNS.
+    """
+
+    def __init__(self, patterns=DEFAULT_EXCLUDE_PATTERNS, path=SPECIALTY_FILE):
+        self.path = path
+        self.regex = compile_patterns(tuple(patterns))
+
+    def mask(self, names):
+        """Boolean Series, True where the name is excluded; NaN is kept."""
+        exact = load_specialty_names(self.path)
+        return names.isin(exact) | names.str.contains(self.regex, na=False)
+
+
+def remove_excluded(df, column, patterns=DEFAULT_EXCLUDE_PATTERNS):
+    """Drop rows of df whose column holds an excluded menu item name."""
+    return df[~ExclusionFilter(patterns).mask(df[column])]
+
+
+def strip_mods(names):
+    """Remove Toast pre-mods ("Add", "Extra", ...) and post-mods from names."""
+    names = names.str.replace(PRE_MOD_RE, "", regex=True)
+    return names.str.replace(POST_MOD_RE, "", regex=True)
@@ -2,8 +2,13 @@ from requests.exceptions import HTTPError
 
 
 # Accounting
-def get_glaccounts(client):
-    return client.get_resource("accounting", "gl-accounts", collection_key="glAccounts")
+def get_glaccounts(client, validator_key=None):
+    return client.get_resource(
+        "accounting",
+        "gl-accounts",
+        collection_key="glAccounts",
+        validator_key=validator_key,
+    )
 
 
 def get_pos_mapping(client, col_key, start_date=None):
@@ -13,17 +18,19 @@ def get_pos_mapping(client, col_key, start_date=None):
 
 
 # Core
-def get_locations(client):
-    return client.get_resource("core", "locations")
+def get_locations(client, validator_key=None):
+    return client.get_resource("core", "locations", validator_key=validator_key)
 
 
 # Inventory
-def get_units_of_measure(client):
-    return client.get_resource("inventory", "units-of-measure")
+def get_units_of_measure(client, validator_key=None):
+    return client.get_resource(
+        "inventory", "units-of-measure", validator_key=validator_key
+    )
 
 
-def get_purchase_items(client):
-    return client.get_resource("inventory", "items")
+def get_purchase_items(client, validator_key=None):
+    return client.get_resource("inventory", "items", validator_key=validator_key)
 
 
 def get_inventory_counts(
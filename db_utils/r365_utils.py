@@ -1,3 +1,7 @@
+import json
+import logging
+import os
+
 import requests
 from db_utils.config import Config
 
@@ -17,6 +21,53 @@ class R365Client:
             }
         )
 
+        self.validators = self.load_validators()
+        self.pending_validators = {}
+
+    # Conditional request helpers
+    def load_validators(self):
+        """Read stored ETag / Last-Modified validators, keyed by table name."""
+        try:
+            if os.path.exists(Config.R365_VALIDATOR_CACHE_FILE):
+                with open(Config.R365_VALIDATOR_CACHE_FILE) as f:
+                    return json.load(f)
+        except Exception as e:
+            logging.warning(f"Error reading R365 validator cache: {e}")
+        return {}
+
+    def commit_validators(self, validator_key):
+        """
+        Persist the validators captured for validator_key.
+
+        Call only after the table has been written successfully, so a failed
+        upsert is retried in full on the next run instead of returning 304.
+        """
+        validators = self.pending_validators.pop(validator_key, None)
+        if not validators:
+            return
+
+        self.validators[validator_key] = validators
+        with open(Config.R365_VALIDATOR_CACHE_FILE, "w") as f:
+            json.dump(self.validators, f, indent=2)
+
+    def conditional_headers(self, validator_key, url, params):
+        stored = self.validators.get(validator_key)
+        if not stored or stored.get("request") != self.request_signature(url, params):
+            return {}
+
+        headers = {}
+        if stored.get("etag"):
+            headers["If-None-Match"] = stored["etag"]
+        if stored.get("last_modified"):
+            headers["If-Modified-Since"] = stored["last_modified"]
+        return headers
+
+    @staticmethod
+    def request_signature(url, params):
+        # requests drops None-valued params, so they do not change the request
+        query = sorted((k, str(v)) for k, v in (params or {}).items() if v is not None)
+        return f"{url}?{query}"
+
     def request(self, method, endpoint, params=None, json=None):
 
         if endpoint.startswith("http"):
@@ -39,14 +90,7 @@ class R365Client:
 
         return None
 
-    def get_all(self, endpoint, params=None, collection_key="items"):
-
-        response = self.request(
-            "GET",
-            endpoint,
-            params=params,
-        )
-
+    def iter_pages(self, response, collection_key="items"):
         while response:
             records = response.get(collection_key, [])
 
@@ -65,8 +109,61 @@ class R365Client:
                 next_link,
             )
 
-    def get_resource(self, domain, resource, collection_key="items", **params):
+    def get_all(self, endpoint, params=None, collection_key="items"):
+
+        response = self.request(
+            "GET",
+            endpoint,
+            params=params,
+        )
+
+        yield from self.iter_pages(response, collection_key)
+
+    def get_if_modified(
+        self, endpoint, validator_key, params=None, collection_key="items"
+    ):
+        """
+        Conditional GET of a collection.
+
+        Sends the validators stored under validator_key and returns None when
+        R365 answers 304 Not Modified. Otherwise returns every record and
+        holds the new validators until commit_validators(validator_key).
+        """
+        url = f"{self.base_url}{endpoint}"
+
+        response = self.session.get(
+            url,
+            params=params,
+            headers=self.conditional_headers(validator_key, url, params),
+            timeout=60,
+        )
+
+        if response.status_code == 304:
+            logging.info(f"{validator_key}: not modified since last run")
+            return None
+
+        response.raise_for_status()
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified:
+            self.pending_validators[validator_key] = {
+                "request": self.request_signature(url, params),
+                "etag": etag,
+                "last_modified": last_modified,
+            }
+
+        data = response.json() if response.content else None
+        return list(self.iter_pages(data, collection_key))
+
+    def get_resource(
+        self, domain, resource, collection_key="items", validator_key=None, **params
+    ):
         endpoint = f"/v1/{domain}/{resource}"
+        if validator_key:
+            return self.get_if_modified(
+                endpoint, validator_key, params=params, collection_key=collection_key
+            )
         return list(
             self.get_all(endpoint, params=params, collection_key=collection_key)
         )
@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS toast_product_mix_ledger (
+    store_id integer NOT NULL,
+    date date NOT NULL,
+    row_count integer NOT NULL,
+    completed_at timestamptz NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (store_id, date)
+);
@@ -2,79 +2,206 @@ import base64
 import json
 import logging
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 
 from db_utils.config import Config
 from db_utils.dbconnect import DatabaseConnection
 
-
-class ToastClient:
-    def __init__(self):
-        self.api_access_url = Config.TOAST_API_ACCESS_URL
-        self.access_token = self.generate_access_token()
-        with DatabaseConnection() as self.db_connection:
-            self.guid_list = self.fetch_locations(self.db_connection.cur)
-
-        self.headers = {
-            "Toast-Restaurant-External-ID": None,  # Set dynamically for each request
-            "Authorization": f"Bearer {self.get_access_token()}",
-        }
+_client_lock = threading.Lock()
+_client = None
+
+
+def get_toast_client():
+    """Return the process-wide ToastClient, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ToastClient()
+        return _client
+
+
+# Toast has used both the IETF draft names and vendor-prefixed names
+RATE_LIMIT_REMAINING_HEADERS = (
+    "RateLimit-Remaining",
+    "X-Toast-RateLimit-Remaining",
+    "X-RateLimit-Remaining",
+)
+RATE_LIMIT_RESET_HEADERS = (
+    "RateLimit-Reset",
+    "X-Toast-RateLimit-Reset",
+    "X-RateLimit-Reset",
+)
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+
+class RateLimiter:
+    """
+    Paces requests to the budget Toast reports in its rate-limit headers.
+
+    The remaining budget is handed out one request at a time under a lock.
+    Once it reaches `reserve`, callers wait for the window to reset. After a
+    reset the new budget is unknown, so a single request goes out first and
+    the rest are released as its response reports the budget, instead of
+    every waiting worker firing at once. A 429 blocks every thread sharing
+    the limiter for the Retry-After delay.
+    """
+
+    # How long other callers wait on a post-reset request before sending another
+    PROBE_TIMEOUT = 60
+
+    def __init__(self, reserve=1):
+        self.reserve = reserve
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.remaining = None
+        self.reset_at = None
+        self.blocked_until = 0.0
+        self.probe_until = 0.0
+
+    def wait(self):
+        with self.ready:
+            while True:
+                now = time.monotonic()
+                if self.blocked_until > now:
+                    self.ready.wait(self.blocked_until - now)
+                    continue
+
+                # No rate-limit headers seen, nothing to pace against
+                if self.reset_at is None:
+                    return
+
+                if self.reset_at <= now:
+                    # Window has rolled over; let one request learn the budget
+                    if self.probe_until > now:
+                        self.ready.wait(self.probe_until - now)
+                        continue
+                    self.probe_until = now + self.PROBE_TIMEOUT
+                    return
+
+                if self.remaining > self.reserve:
+                    # Count in-flight requests against the budget
+                    self.remaining -= 1
+                    return
+
+                self.ready.wait(self.reset_at - now)
+
+    def update(self, response):
+        remaining = self.header_value(response, RATE_LIMIT_REMAINING_HEADERS)
+        reset = self.header_value(response, RATE_LIMIT_RESET_HEADERS)
+
+        with self.ready:
+            self.probe_until = 0.0
+            if remaining is None or reset is None:
+                self.remaining = None
+                self.reset_at = None
+            else:
+                # Reset is either seconds until reset or an epoch timestamp
+                if reset > 1_000_000_000:
+                    reset = reset - time.time()
+                self.remaining = int(remaining)
+                self.reset_at = time.monotonic() + max(reset, 0)
+            self.ready.notify_all()
+
+    def backoff(self, response, attempt):
+        """Block all callers after a 429 / 5xx and return the delay used."""
+        delay = self.header_value(response, ("Retry-After",))
+        if delay is None:
+            delay = min(2**attempt, 60)
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        return delay
+
+    @staticmethod
+    def header_value(response, names):
+        for name in names:
+            value = response.headers.get(name)
+            if value is not None:
+                try:
+                    return float(value)
+                except ValueError:
+                    return None
+        return None
+
+
+class TokenManager:
+    """
+    Thread-safe, in-memory holder for the Toast access token.
+
+    The token is refreshed `refresh_margin` seconds before its JWT `exp`,
+    so long runs roll over to a new token before requests start failing.
+    TOKEN_CACHE_FILE is read only when there is no usable token in memory.
+    """
+
+    def __init__(self, refresh_margin=300):
+        self.refresh_margin = refresh_margin
+        self.lock = threading.Lock()
+        self.token = None
+        self.expires_at = 0.0
+        self.rejected = None
+
+    def get_token(self):
+        with self.lock:
+            refresh_at = self.expires_at - self.refresh_margin
+            if self.token is None or time.time() >= refresh_at:
+                self.refresh()
+            return self.token
+
+    def invalidate(self, token):
+        """Drop a token the API rejected, unless another thread already replaced it."""
+        with self.lock:
+            self.rejected = token
+            if self.token == token:
+                self.token = None
+
+    def refresh(self):
+        token = self.read_token_cache() or self.fetch_access_token()
+        if token is None:
+            raise RuntimeError("Unable to obtain a Toast access token")
+        self.token = token
+        self.expires_at = self.token_expiry(token)
 
     # Helper Functions
-    def decode_jwt(self, token):
+    @staticmethod
+    def decode_jwt(token):
         """Decode a JWT without verification just to extract the payload"""
         payload = token.split(".")[1]
         padded = payload + "=" * (-len(payload) % 4)  # JWT base64 padding
         decoded_bytes = base64.urlsafe_b64decode(padded)
         return json.loads(decoded_bytes)
 
-    def fetch_locations(self, cur) -> pd.DataFrame:
-        cur.execute(
-            """
-            SELECT id, name, toast_guid
-            FROM restaurants
-            WHERE email IS NOT Null
-            ORDER BY name
-            """
-        )
-        locations = cur.fetchall()
-
-        return pd.DataFrame(locations, columns=["id", "name", "toast_guid"])
+    @staticmethod
+    def access_token_string(token):
+        # The login endpoint returns {"accessToken": ..., "expiresIn": ...}
+        if isinstance(token, dict):
+            token = token.get("accessToken")
+        return token if isinstance(token, str) and token else None
 
-    # Return Current Access Token
-    def get_access_token(self):
-        return self.access_token["accessToken"] if self.access_token else None
+    def token_expiry(self, token):
+        return self.decode_jwt(token).get("exp", 0)
 
-    def get_api_access_url(self):
-        return self.api_access_url
-
-    def get_locations(self):
-        return self.guid_list
-
-    # Generate Access Token (Was get_access_token)
-    def generate_access_token(self):
-        """
-        Fetches the OAuth2 access token required to authenticate API requests.
-        """
+    def read_token_cache(self):
         try:
             if os.path.exists(Config.TOKEN_CACHE_FILE):
                 with open(Config.TOKEN_CACHE_FILE) as f:
-                    cache = json.load(f)
-                    token = cache.get("token")
-                    if isinstance(token, dict):
-                        token = token.get("token")
-                    if token and isinstance(token, str):
-                        payload = self.decode_jwt(token)
-                        exp = payload.get("exp", 0)
-                        if time.time() < exp - 60:  # valid for more than 1 minute
+                    token = self.access_token_string(json.load(f).get("token"))
+                    if token and token != self.rejected:
+                        if time.time() < self.token_expiry(token) - self.refresh_margin:
                             return token
         except Exception as e:
             logging.warning(f"Error reading token cache: {e}")
+        return None
 
-        url = self.api_access_url + "/authentication/v1/authentication/login"
+    def fetch_access_token(self):
+        """
+        Fetches the OAuth2 access token required to authenticate API requests.
+        """
+        url = Config.TOAST_API_ACCESS_URL + "/authentication/v1/authentication/login"
         headers = {
             "Content-Type": "application/json"  # This ensures the correct content type
         }
@@ -93,7 +220,7 @@ class ToastClient:
                 with open(Config.TOKEN_CACHE_FILE, "w") as f:
                     json.dump({"token": token}, f)
                 logging.info("Fetched new access token")
-                return token
+                return self.access_token_string(token)
             else:
                 logging.info(f"Failed to fetch access token. Response: {response.text}")
                 return None
@@ -101,7 +228,148 @@ class ToastClient:
             logging.error(f"Error fetching access token: {e}")
             return None
 
-    def get_response_data(self, url, guid, params=None, rate_limit_wait=1.0):
+
+# Shared by every ToastClient in the process so a run authenticates once
+token_manager = TokenManager()
+
+
+def concurrent_map(fn, items, *args, max_workers=None, **kwargs):
+    """
+    Call fn(item, *args, **kwargs) for every item on a bounded thread pool.
+
+    Results are returned in the same order as items. The first exception
+    raised by a worker is re-raised here.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    max_workers = min(max_workers or Config.TOAST_MAX_WORKERS, len(items))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda item: fn(item, *args, **kwargs), items))
+
+
+class ToastClient:
+    def __init__(self):
+        self.api_access_url = Config.TOAST_API_ACCESS_URL
+
+        # One pooled session shared by every worker thread
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=Config.TOAST_MAX_WORKERS,
+            pool_maxsize=Config.TOAST_MAX_WORKERS * 4,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.rate_limiter = RateLimiter()
+
+        # Restaurants are queried on first use, not on construction
+        self._locations_lock = threading.Lock()
+        self._guid_list = None
+
+    @property
+    def guid_list(self):
+        with self._locations_lock:
+            if self._guid_list is None:
+                with DatabaseConnection() as db:
+                    self._guid_list = self.fetch_locations(db.cur)
+        return self._guid_list
+
+    def fetch_locations(self, cur) -> pd.DataFrame:
+        cur.execute(
+            """
+            SELECT id, name, toast_guid
+            FROM restaurants
+            WHERE email IS NOT Null
+            ORDER BY name
+            """
+        )
+        locations = cur.fetchall()
+
+        return pd.DataFrame(locations, columns=["id", "name", "toast_guid"])
+
+    # Return Current Access Token
+    def get_access_token(self):
+        return token_manager.get_token()
+
+    @property
+    def access_token(self):
+        return self.get_access_token()
+
+    def get_api_access_url(self):
+        return self.api_access_url
+
+    def get_locations(self):
+        return self.guid_list
+
+    def request_headers(self, guid, token=None):
+        """Headers for a single request; never shared between threads."""
+        return {
+            "Toast-Restaurant-External-ID": guid,
+            "Authorization": f"Bearer {token or self.get_access_token()}",
+        }
+
+    def get(self, url, guid, params=None):
+        """
+        GET a Toast endpoint, paced by the shared rate limiter.
+
+        429 and 5xx gateway responses are retried with backoff; once
+        Config.TOAST_MAX_RETRIES is exhausted an HTTPError is raised rather
+        than handing back a partial result. A 401 is retried once with a
+        freshly issued token.
+        """
+        reauthenticated = False
+        for attempt in range(Config.TOAST_MAX_RETRIES + 1):
+            self.rate_limiter.wait()
+            token = self.get_access_token()
+            response = self.session.get(
+                self.api_access_url + url,
+                headers=self.request_headers(guid, token),
+                params=params,
+                timeout=60,
+            )
+            self.rate_limiter.update(response)
+
+            if response.status_code == 401 and not reauthenticated:
+                logging.info("Toast access token rejected, re-authenticating")
+                token_manager.invalidate(token)
+                reauthenticated = True
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES:
+                return response
+
+            if attempt < Config.TOAST_MAX_RETRIES:
+                delay = self.rate_limiter.backoff(response, attempt)
+                logging.warning(
+                    f"Toast returned {response.status_code} for {url}, "
+                    f"retrying in {delay:.1f}s"
+                )
+
+        response.raise_for_status()
+        return response
+
+    def map_locations(self, fn, *args, locations=None, max_workers=None, **kwargs):
+        """
+        Run fn(location, *args, **kwargs) concurrently for each location.
+
+        locations defaults to the restaurants loaded for this client, one
+        row (id, name, toast_guid) per location. Concurrency is capped at
+        Config.TOAST_MAX_WORKERS, and every worker shares this client's
+        rate limiter.
+        """
+        if locations is None:
+            locations = self.get_locations().to_dict("records")
+        return concurrent_map(fn, locations, *args, max_workers=max_workers, **kwargs)
+
+    # Generate Access Token (Was get_access_token)
+    def generate_access_token(self):
+        """
+        Returns the OAuth2 access token required to authenticate API requests.
+        """
+        return token_manager.get_token()
+
+    def get_response_data(self, url, guid, params=None, rate_limit_wait=0):
         """
         Fetch all pages from a paginated Toast API endpoint.
 
@@ -109,7 +377,7 @@ class ToastClient:
             url (str): The base URL of the Toast API endpoint.
             headers (dict): Headers to include in the request (must include authorization).
             params (dict, optional): Any initial query parameters. Can include 'startDate', 'endDate', etc.
-            rate_limit_wait (float): Time (in seconds) to wait between paginated requests, to avoid rate limits.
+            rate_limit_wait (float): Extra delay between pages; pacing normally comes from the rate limiter.
 
         Returns:
             List[dict]: Aggregated list of results from all pages.
@@ -126,14 +394,10 @@ class ToastClient:
             if page_token:
                 request_params["pageToken"] = page_token
 
-            self.headers["Toast-Restaurant-External-ID"] = guid
-            response = requests.get(
-                self.api_access_url + url, headers=self.headers, params=request_params
-            )
+            response = self.get(url, guid, params=request_params)
 
-            if not response.ok:
-                print(f"Error {response.status_code}: {response.text}")
-                break
+            # Retries are spent by now; fail rather than return a partial pull
+            response.raise_for_status()
 
             # Add current page of data to results
             data = response.json()
@@ -157,7 +421,8 @@ class ToastClient:
 
             page += 1
 
-            time.sleep(rate_limit_wait)
+            if rate_limit_wait:
+                time.sleep(rate_limit_wait)
 
         return results
 
@@ -167,7 +432,7 @@ class ToastClient:
         guid,
         params=None,
         page_size=100,
-        rate_limit_wait=1.0,
+        rate_limit_wait=0,
     ):
         """
         Fetch all pages from a Toast endpoint that uses page-number pagination.
@@ -177,15 +442,35 @@ class ToastClient:
             guid (str): Restaurant GUID.
             params (dict, optional): Initial query parameters.
             page_size (int): Number of records per page (max 100).
-            rate_limit_wait (float): Delay between requests.
+            rate_limit_wait (float): Extra delay between pages.
 
         Returns:
             list: Aggregated results from all pages.
         """
+        results = []
+        for page in self.iter_paged_response_data(
+            url, guid, params, page_size, rate_limit_wait
+        ):
+            results.extend(page)
+        return results
+
+    def iter_paged_response_data(
+        self,
+        url,
+        guid,
+        params=None,
+        page_size=100,
+        rate_limit_wait=0,
+    ):
+        """
+        Yield one page at a time from a page-number paginated Toast endpoint.
+
+        Callers that process records as they arrive only hold a single page
+        in memory instead of the whole result set.
+        """
         if guid is None:
             raise ValueError("GUID is required for Toast API requests.")
 
-        results = []
         page = 1
 
         while True:
@@ -193,22 +478,15 @@ class ToastClient:
             request_params["page"] = page
             request_params["pageSize"] = page_size
 
-            self.headers["Toast-Restaurant-External-ID"] = guid
+            response = self.get(url, guid, params=request_params)
 
-            response = requests.get(
-                self.api_access_url + url,
-                headers=self.headers,
-                params=request_params,
-            )
-
-            if not response.ok:
-                print(f"Error {response.status_code}: {response.text}")
-                break
+            # Retries are spent by now; fail rather than return a partial pull
+            response.raise_for_status()
 
             data = response.json()
 
             if isinstance(data, list):
-                results.extend(data)
+                yield data
                 records = len(data)
             else:
                 raise ValueError(f"Expected list response, got {type(data).__name__}")
@@ -222,24 +500,29 @@ class ToastClient:
                 break
 
             page += 1
-            time.sleep(rate_limit_wait)
-
-        return results
+            if rate_limit_wait:
+                time.sleep(rate_limit_wait)
 
-    def extract_menu_items(
-        self, guid, menu_id, menu_name, menu_group, parent_group_path=None
-    ):
-        extracted = []
+    @staticmethod
+    def iter_menu_items(guid, menu_id, menu_name, menu_group):
+        """
+        Yield one row per menu item in menu_group and all of its subgroups.
 
-        group_name = menu_group.get("name", "")
-        group_path = (
-            f"{parent_group_path} > {group_name}" if parent_group_path else group_name
-        )
+        Walks the group tree with an explicit stack instead of recursion; each
+        group's path string is built once and shared by its items.
+        """
+        stack = [(menu_group, None)]
+        while stack:
+            group, parent_group_path = stack.pop()
+            group_name = group.get("name", "")
+            group_path = (
+                f"{parent_group_path} > {group_name}"
+                if parent_group_path
+                else group_name
+            )
 
-        # Add items if they exist at this level
-        for item in menu_group.get("menuItems", []):
-            extracted.append(
-                {
+            for item in group.get("menuItems", []):
+                yield {
                     "location_guid": guid,
                     "menu_id": menu_id,
                     "menu_name": menu_name,
@@ -248,18 +531,18 @@ class ToastClient:
                     "pos_name": item.get("posName", ""),
                     "kitchen_name": item.get("kitchenName", ""),
                 }
-            )
 
-        # Recursively explore nested subgroups
-        for subgroup in menu_group.get("menuGroups", []):
-            extracted.extend(
-                self.extract_menu_items(guid, menu_id, menu_name, subgroup, group_path)
-            )
+            # Reversed so subgroups come off the stack in menu order
+            for subgroup in reversed(group.get("menuGroups", [])):
+                stack.append((subgroup, group_path))
 
-        # print(
-        #     f"{'  ' * group_path.count('>')}Group: {group_name} — Items: {len(menu_group.get('menuItems', []))}"
-        # )
-        return extracted
+    def extract_menu_items(
+        self, guid, menu_id, menu_name, menu_group, parent_group_path=None
+    ):
+        if parent_group_path:
+            group_name = menu_group.get("name", "")
+            menu_group = {**menu_group, "name": f"{parent_group_path} > {group_name}"}
+        return list(self.iter_menu_items(guid, menu_id, menu_name, menu_group))
 
     def get_restaurants(self):
         managementGroupGUID = Config.MANAGEMENT_GROUP_GUID
@@ -270,28 +553,29 @@ class ToastClient:
         guid_list = [item for item in guid_list if item not in drop_list]
         return guid_list
 
-    def get_restaurant_config(self, token, guid_list):
-        df = pd.DataFrame()
-        for guid in guid_list:
-            url = self.api_access_url + "/restaurants/v1/restaurants/" + guid
-            headers = {
-                "Toast-Restaurant-External-ID": guid,
-                "Authorization": f"Bearer {token}",
-            }
-            response = requests.get(url, headers=headers)
-            if response.status_code == 200:
-                json_data = response.json()
-                general = json_data.get("general", {})
-                data = {
-                    "location_guid": guid,
-                    "concept": general.get("name", ""),
-                    "location_name": general.get("locationName", ""),
-                    "location_code": general.get("locationCode", ""),
-                }
-                extracted_data = pd.DataFrame([data])
-                df = pd.concat([df, extracted_data])
-            else:
-                raise RuntimeError(
-                    f"Failed to fetch restaurant config for GUID {guid}: {response.status_code} - {response.text}"
-                )
-        return df
+    def fetch_restaurant_config(self, guid):
+        response = self.get("/restaurants/v1/restaurants/" + guid, guid)
+        if response.status_code != 200:
+            raise RuntimeError(
+                f"Failed to fetch restaurant config for GUID {guid}: {response.status_code} - {response.text}"
+            )
+
+        general = response.json().get("general", {})
+        return {
+            "location_guid": guid,
+            "concept": general.get("name", ""),
+            "location_name": general.get("locationName", ""),
+            "location_code": general.get("locationCode", ""),
+        }
+
+    def get_restaurant_config(self, token=None, guid_list=None):
+        # token is accepted for older callers; requests authenticate through
+        # the shared token manager
+        if guid_list is None:
+            guid_list = self.get_restaurants()
+
+        records = concurrent_map(self.fetch_restaurant_config, guid_list)
+        return pd.DataFrame(
+            records,
+            columns=["location_guid", "concept", "location_name", "location_code"],
+        )
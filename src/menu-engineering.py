@@ -3,160 +3,62 @@ Import sales mix and export menu engineering report to excel
 """
 
 import argparse
+import hashlib
+import json
 import os
-import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 
-import numpy as np
-import openpyxl
 import pandas as pd
-from openpyxl.styles import NamedStyle
-
-pd.set_option("future.no_silent_downcasting", True)
-
-
-def removedups(x):
-    """Turn the list into a dict then back to a list to remove duplicates"""
-    return list(dict.fromkeys(x))
-
-
-def engineer(df):
-    """Assigns bool if less than mean for Quantity and Margin"""
-    qtm = df["Qty"].mean()
-    df["qty_mn"] = np.where(df.Qty < qtm, False, True)
-    mrgn = df["Margin"].mean()
-    df["mrg_mn"] = np.where(df.Margin < mrgn, False, True)
-    return df
-
-
-def rating(df):
-    """Assigns rating to each menu item"""
-    if df["qty_mn"] is True:
-        if df["mrg_mn"] is True:
-            return "Star"
-        else:
-            return "Opportunity"
-    if df["qty_mn"] is False:
-        if df["mrg_mn"] is True:
-            return "Puzzle"
-        else:
-            return "Dog"
-
-
-def make_dataframe(catg, product_mix):
-    """Separates each store into it's own dataframe"""
-    df = product_mix.drop(product_mix[product_mix.Textbox27 != catg].index)
-    return df
-
-
-def make_dataframe1(catg, menu_analysis):
-    """Separates each store into it's own dataframe"""
-    df = menu_analysis.drop(menu_analysis[menu_analysis.Location != catg].index)
-    return df
-
-
-def menucatagory(catg, df_menu):
-    """Create a separate dataframe for each menu category"""
-    df = df_menu.drop(df_menu[df_menu.Cat2 != catg].index)
-    if df.empty:
-        print(f"{catg} is empty")
-    return df
 
+from db_utils.dbconnect import DatabaseConnection
+from db_utils.menu_engineering import (
+    BREAD_BASKET_FALLBACK_COSTS,
+    REPORT_BREAD_BASKET_COSTS,
+    REPORT_COLUMNS,
+    add_bread_basket,
+    add_metrics,
+    bread_basket_rows,
+    classify,
+    frame_fingerprint,
+    get_menu_mix,
+    get_week_dates,
+    resolve_costs,
+    write_store_workbook,
+)
+from db_utils.menu_utils import (
+    DEFAULT_EXCLUDE_PATTERNS,
+    load_specialty_names,
+    remove_excluded,
+    strip_mods,
+)
 
-def removeSpecial(df):
-    """Removes specialty items from the dataframe"""
-    try:
-        with open("./specialty.txt") as file:
-            specialty_patterns = [line.strip() for line in file if line.strip()]
-    except FileNotFoundError:
-        specialty_patterns = []
-
-    # Remove exact matches
-    if specialty_patterns:
-        df = df[~df.MenuItem.isin(specialty_patterns)]
-
-    # Combine all regex patterns into one
-    regex_patterns = [
-        r"^No ",
-        r" Only$",
-        r" Tax$",
-        r"^& ",
-        r"^Seat ",
-        r"Allergy$",
-        r"Outstanding$",
-        r"for Salad.*",
-        r".*for Steak.*",
-        r".*for Sand.*",
-        r".*for Taco.*",
-        r".*for Cali-Club.*",
-        r".*for Edge.*",
-        r".*See Server.*",
-        r".*Refund.*",
-        r".*2 Pens.*",
-        # r"Catering$",
-    ]
-    combined_pattern = "|".join(f"(?:{pat})" for pat in regex_patterns)
-    df = df[~df.MenuItem.str.contains(combined_pattern, na=False, regex=True)]
-
-    return df
-
-
-def removePreMods(df):
-    # Remove toast Pre-Mods from MenuItem strings
-    pre_mods = ["Add", "Extra", "Lite", "On Side"]
-    post_mods = ["On Side", "Only"]
-
-    # Create regex patterns for pre and post modifications
-    pre_pattern = r"^(" + "|".join(pre_mods) + r")\s+"
-    post_pattern = r"\s+(" + "|".join(post_mods) + r")$"
-
-    # Apply the regex patterns to the MenuItem column
-    df["MenuItem"] = df["MenuItem"].apply(lambda x: re.sub(pre_pattern, "", x))
-    df["MenuItem"] = df["MenuItem"].apply(lambda x: re.sub(post_pattern, "", x))
-
-    return df
-
-
-# used for adding bread basket to menu engineering
-def add_new_row(location, menu_item, cost, df):
-    new_row = pd.DataFrame(
-        {"Location": location, "MenuItem": menu_item, "Cost": cost},
-        index=[0],
-    )
-    return pd.concat([df, new_row], ignore_index=True)
-
-
-def format_excel(file_path):
-    wb = openpyxl.load_workbook(file_path)
-
-    for sheet_name in wb.sheetnames:
-        sheet = wb[sheet_name]
-
-        if "currency" not in wb.named_styles:
-            currency_style = NamedStyle(name="currency", number_format="#,##0.00")
-            for col in ["C", "D", "E", "F", "G", "H", "I"]:
-                for cell in sheet[col]:
-                    cell.style = currency_style
-
-            for cell in sheet["F"]:
-                cell.number_format = "0.0%"
-
-            for col in sheet.columns:
-                max_length = 0
-                column = col[0].column_letter
-                for cell in col:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(cell.value)
-                    except Exception as e:
-                        print(repr(e))
-                        pass
-                adjusted_width = (max_length + 2) * 1.2
-                sheet.column_dimensions[column].width = adjusted_width
-
-    wb.save(file_path)
-
+pd.set_option("future.no_silent_downcasting", True)
 
-def main(product_mix_csv, menu_analysis_csv, sort_unit):
+OUTPUT_DIR = "/home/wandored/Projects/menu-engineering/output/"
+SYNC_DIR = "/home/wandored/Sync/ReportData/"
+# Fingerprint of each store's inputs as of its last written workbook
+MANIFEST_FILE = os.path.join(OUTPUT_DIR, "manifest.json")
+# Bump when the report's calculations or layout change to rebuild every store
+MANIFEST_VERSION = 1
+
+
+# Menu mix columns as they appear in the report
+REPORT_NAMES = {
+    "location": "store",
+    "menu_item": "MenuItem",
+    "quantity": "Qty",
+    "menu_price": "Price",
+    "menu_cost": "Cost",
+    "sales": "Sales",
+    "category1": "Cat1",
+    "category2": "Cat2",
+    "category3": "Cat3",
+}
+
+
+def read_csv_menu(product_mix_csv, menu_analysis_csv):
+    """Menu mix for every store from the R365 Product Mix and Menu Price exports"""
     product_mix = pd.read_csv(product_mix_csv, skiprows=3, sep=",", thousands=",")
     product_mix.loc[:, "Textbox27"] = product_mix["Textbox27"].str.replace(
         r"CHOPHOUSE\ -\ NOLA", "CHOPHOUSE-NOLA", regex=True
@@ -186,206 +88,183 @@ def main(product_mix_csv, menu_analysis_csv, sort_unit):
     )
 
     menu_analysis["Location"] = menu_analysis["Location"].str.strip()
-    df_nonetab = pd.DataFrame()
-    store_list = product_mix["Textbox27"].unique()
-    # store_list = removedups(store_list)
-
-    # Make dictionary of dataframes for each location
-    product_dict = {store: make_dataframe(store, product_mix) for store in store_list}
-    price_dict = {store: make_dataframe1(store, menu_analysis) for store in store_list}
-
-    for key in product_dict.keys():
-        product_dict[key][["x", "MenuItem"]] = product_dict[key][
-            "TransferDate"
-        ].str.split(" - ", expand=True)
-        # product_dict[key]["Textbox27"].rename("Location", inplace=True)
-        product_dict[key].rename(
-            columns={"Cost": "Price", "Total": "Sales"}, inplace=True
-        )
-        product_dict[key].drop(
-            columns={
-                "Textbox3",
-                "x",
-                "TransferDate",
-                "ToLocationName",
-                "dm_Quantity",
-                "Textbox17",
-                "Textbox20",
-            },
-            inplace=True,
-        )
-        df_pmix = product_dict[key].reindex(
-            columns=[
-                "MenuItem",
-                "Qty",
-                "Price",
-                "Sales",
-                "Cat1",
-                "Cat2",
-                "Cat3",
-            ]
-        )
-        # set MenuItem data type to string
-        df_pmix["MenuItem"] = df_pmix["MenuItem"].astype(str)
-        # Calculate Bread Basket usage for stores with bread
-        stores_w_bread = [
-            "NEW YORK PRIME-MYRTLE BEACH",
-            "NEW YORK PRIME-BOCA",
-            "NEW YORK PRIME-ATLANTA",
-            "CHOPHOUSE-NOLA",
-            "CHOPHOUSE '47",
-            "GULFSTREAM CAFE",
-        ]
-        entree_count = df_pmix.loc[df_pmix["Cat2"] == "Entree", "Qty"].sum()
-        if product_dict[key].iloc[0, 0] in stores_w_bread:
-            # add bread basket to df_menu
-            new_row = {
-                "MenuItem": "Bread Basket per Entree",
-                "Qty": entree_count,
-                "Price": 0,
-                "Sales": 0,
-                "Cat1": "Food",
-                "Cat2": "No Charge",
-                "Cat3": "None",
-            }
-            df_pmix = pd.concat(
-                [df_pmix, pd.DataFrame(new_row, index=[0])], ignore_index=True
-            )
 
-        product_dict[key] = df_pmix
+    # Product mix for every store in one frame, keyed by store and item
+    product_mix = product_mix.rename(
+        columns={
+            "Textbox27": "location",
+            "Qty": "quantity",
+            "Cost": "menu_price",
+            "Total": "sales",
+            "Cat1": "category1",
+            "Cat2": "category2",
+            "Cat3": "category3",
+        }
+    )
+    product_mix["menu_item"] = (
+        product_mix["TransferDate"].str.split(" - ", n=1, expand=True)[1].astype(str)
+    )
+    product_mix = product_mix.reindex(
+        columns=[
+            "location",
+            "menu_item",
+            "quantity",
+            "menu_price",
+            "sales",
+            "category1",
+            "category2",
+            "category3",
+        ]
+    )
 
     # Menu Price Analysis used for food cost info.
-    for key in price_dict.keys():
-        price_dict[key].rename(columns={"UnitCost_Loc": "Cost"}, inplace=True)
-        try:
-            price_dict[key][["X", "MenuItem"]] = price_dict[key][
-                "MenuItemName"
-            ].str.split(" - ", expand=True)
-        except KeyError:
-            print(f'{price_dict[key]["MenuItemName"]} "key error"')
-        except Exception as e:
-            print(repr(e))
-        df_pmix = price_dict[key].reindex(columns=["Location", "MenuItem", "Cost"])
-        df_pmix["MenuItem"] = df_pmix["MenuItem"].astype(str)
-
-        location = df_pmix.iloc[0, 0]
-
-        # Define a dictionary to map location names to their respective data.
-        location_data = {
-            "CHOPHOUSE-NOLA": ("Bread Basket per Entree", 0.35),
-            "CHOPHOUSE '47": ("Bread Basket per Entree", 0.35),
-            "GULFSTREAM CAFE": ("Bread Basket per Entree", 0.92),
-            "NEW YORK PRIME-MYRTLE BEACH": ("Bread Basket per Entree", 0.79),
-            "NEW YORK PRIME-BOCA": ("Bread Basket per Entree", 0.85),
-            "NEW YORK PRIME-ATLANTA": ("Bread Basket per Entree", 0.83),
+    menu_analysis = menu_analysis.rename(
+        columns={"Location": "location", "UnitCost_Loc": "menu_cost"}
+    )
+    menu_analysis["menu_item"] = (
+        menu_analysis["MenuItemName"]
+        .str.split(" - ", n=1, expand=True)[1]
+        .astype(str)
+    )
+
+    df_menu = pd.merge(
+        product_mix,
+        menu_analysis[["location", "menu_item", "menu_cost"]],
+        on=["location", "menu_item"],
+        how="left",
+        sort=False,
+    )
+    # The report keeps its own per-store bread basket costs, no database needed
+    bread_costs = pd.DataFrame(
+        {
+            "location": list(REPORT_BREAD_BASKET_COSTS),
+            "menu_cost": list(REPORT_BREAD_BASKET_COSTS.values()),
         }
+    )
+    bread = bread_basket_rows(df_menu, bread_costs, ["location"], ["location"])
+    df_menu = pd.concat([df_menu, bread], ignore_index=True)
+    return df_menu.rename(columns=REPORT_NAMES)
+
+
+def read_db_menu(db, year, period, week):
+    """Menu mix for every store for one fiscal week, aggregated in the database"""
+    start_date, end_date = get_week_dates(db, year, period, week)
+    df_menu = add_bread_basket(
+        get_menu_mix(db, start_date, end_date),
+        db,
+        group_cols=["store_id", "week_end"],
+        as_of_col="week_end",
+    )
+    df_menu = resolve_costs(df_menu)
+    df_menu["menu_cost"] = df_menu["menu_cost"].fillna(0)
+    return df_menu.rename(columns=REPORT_NAMES)
 
-        # Check if the location exists in the dictionary, then add the new row.
-        if location in location_data:
-            menu_item, cost = location_data[location]
-            df_pmix = add_new_row(location, menu_item, cost, df_pmix)
-        price_dict[key] = df_pmix
-
-    directory = "/home/wandored/Projects/menu-engineering/output/"
-    for store in store_list:
-        df_menu = pd.merge(
-            product_dict[store],
-            price_dict[store],
-            on="MenuItem",
-            how="left",
-            sort=False,
-        )
-        df_menu.rename(columns={"Location_x": "Location"}, inplace=True)
-        df_pmix = df_menu.reindex(
-            columns=[
-                "Location",
-                "MenuItem",
-                "Qty",
-                "Price",
-                "Sales",
-                "Cost",
-                "Cat1",
-                "Cat2",
-                "Cat3",
-            ]
-        )
-        df_menu = removeSpecial(df_pmix)
-        df_menu = removePreMods(df_menu)
-
-        cat2_list = df_menu["Cat2"]
-        cat2_list = removedups(cat2_list)
-        # if "nan" in cat2_list replace it with "None"
-        cat2_list = [x if str(x) != "nan" else "None" for x in cat2_list]
-        df_menu["cost"] = df_menu["Cost"].fillna(0)
-        df_menu["Cost %"] = df_menu.apply(
-            lambda row: row.Cost / row.Price if row.Price else 0, axis=1
-        )
-        df_menu["Margin"] = df_menu.apply(lambda row: row.Price - row.Cost, axis=1)
-        df_menu["Total Cost"] = df_menu.apply(lambda row: row.Qty * row.Cost, axis=1)
-        df_menu["Profit"] = df_menu.apply(lambda row: row.Qty * row.Margin, axis=1)
-        df_pmix = df_menu.reindex(
-            columns=[
-                "Location",
-                "MenuItem",
-                "Qty",
-                "Price",
-                "Cost",
-                "Margin",
-                "Cost %",
-                "Sales",
-                "Total Cost",
-                "Profit",
-                "Cat1",
-                "Cat2",
-                "Cat3",
-            ]
-        )
-        df_menu = df_pmix
-        # select all rows where cat2 is nan
-        df_none = df_menu[df_menu["Cat2"].isnull()]
-        # Fill NaN values in menu["cat2"] with "None"
-        df_menu["Cat2"] = df_menu["Cat2"].fillna("None")
-        columns_to_fill_none = ["Cat1", "Cat2", "Cat3"]
-        df_none.loc[:, columns_to_fill_none] = (
-            df_none.loc[:, columns_to_fill_none].fillna("None").astype(str)
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def settings_fingerprint():
+    """Hash of the report inputs shared by every store: version, filters, costs"""
+    settings = (
+        MANIFEST_VERSION,
+        sorted(load_specialty_names()),
+        DEFAULT_EXCLUDE_PATTERNS,
+        sorted(BREAD_BASKET_FALLBACK_COSTS.items()),
+        sorted(REPORT_BREAD_BASKET_COSTS.items()),
+    )
+    return hashlib.sha256(repr(settings).encode()).hexdigest()
+
+
+def main(df_menu, sort_unit, force=False):
+    """
+    Build the menu engineering workbooks and return the paths written.
+
+    Each store's inputs, together with the shared settings (specialty items,
+    exclusion patterns, bread basket costs and MANIFEST_VERSION), are
+    fingerprinted and compared with the manifest from the last run; only
+    stores whose inputs changed, or whose workbook is missing, are written
+    again unless force is set.
+    """
+    settings = settings_fingerprint()
+    fingerprints = {
+        store: frame_fingerprint(inputs, salt=settings)
+        for store, inputs in df_menu.groupby("store", sort=False)
+    }
+    manifest = load_manifest(MANIFEST_FILE)
+    changed = {
+        store
+        for store, fingerprint in fingerprints.items()
+        if force
+        or manifest.get(store) != fingerprint
+        or not os.path.exists(os.path.join(OUTPUT_DIR, f"{store}.xlsx"))
+    }
+    print(f"{len(changed)} of {len(fingerprints)} stores changed")
+
+    df_menu = remove_excluded(df_menu, "MenuItem")
+    df_menu = df_menu.assign(MenuItem=strip_mods(df_menu["MenuItem"]))
+
+    # Metrics and ratings for every store and category at once
+    add_metrics(df_menu, REPORT_COLUMNS)
+    df_menu = df_menu.reindex(
+        columns=[
+            "store",
+            "MenuItem",
+            "Qty",
+            "Price",
+            "Cost",
+            "Margin",
+            "Cost %",
+            "Sales",
+            "Total Cost",
+            "Profit",
+            "Cat1",
+            "Cat2",
+            "Cat3",
+        ]
+    )
+    # select all rows where cat2 is nan
+    df_none = df_menu[df_menu["Cat2"].isnull()].drop(columns="store")
+    # Fill NaN values in menu["cat2"] with "None"
+    df_menu["Cat2"] = df_menu["Cat2"].fillna("None")
+    columns_to_fill_none = ["Cat1", "Cat2", "Cat3"]
+    df_none.loc[:, columns_to_fill_none] = (
+        df_none.loc[:, columns_to_fill_none].fillna("None").astype(str)
+    )
+    # # # Fill NaN values in all other columns with 0
+    df_nonetab = df_none.fillna(0).infer_objects(copy=False)
+    classify(df_menu, ["store", "Cat2"], REPORT_COLUMNS)
+
+    # One pass over (store, category) groups collects each store's sheets in
+    # menu order; the workbooks are then written in parallel
+    workbooks = {}
+    changed_menu = df_menu[df_menu["store"].isin(changed)]
+    for (store, cat), df in changed_menu.groupby(["store", "Cat2"], sort=False):
+        df = df.drop(columns=["store", "Cat3"]).sort_values(
+            by=["Profit", "Qty"], ascending=False, ignore_index=True
         )
-        # # # Fill NaN values in all other columns with 0
-        df_none = df_none.fillna(0).infer_objects(copy=False)
-
-        if not df_none.empty:
-            df_nonetab = pd.concat([df_nonetab, df_none])
-
-        # drop nan from cat2_list
-        cat2_list = [x for x in cat2_list if str(x) != "nan"]
-
-        with pd.ExcelWriter(f"{directory}/{store}.xlsx") as writer:  # pylint: disable=abstract-class-instantiated
-            for cat in cat2_list:
-                df = menucatagory(cat, df_menu)
-                df = engineer(df)
-                df["rating"] = df.apply(rating, axis=1)
-                df.sort_values(
-                    by=["Profit", "Qty"],
-                    inplace=True,
-                    ascending=False,
-                    ignore_index=True,
-                )
-                df.drop(columns={"Location", "Cat3", "qty_mn", "mrg_mn"}, inplace=True)
-                df.loc["Total"] = pd.Series(
-                    df[["Qty", "Sales", "Total Cost", "Profit"]].sum()
-                )
-                if df.at["Total", "Sales"]:
-                    df.at["Total", "Cost %"] = (
-                        df.at["Total", "Total Cost"] / df.at["Total", "Sales"]
-                    )
-                else:
-                    df.at["Total", "Cost %"] = 1
-                df.to_excel(writer, sheet_name=cat, index=False)
-
-    # Format excel files
-    # excel_files = [file for file in os.listdir(directory) if file.endswith(".xlsx")]
-    # for file in excel_files:
-    #     file_path = os.path.join(directory, file)
-    #     format_excel(file_path)
+        df.loc["Total"] = pd.Series(df[["Qty", "Sales", "Total Cost", "Profit"]].sum())
+        if df.at["Total", "Sales"]:
+            df.at["Total", "Cost %"] = (
+                df.at["Total", "Total Cost"] / df.at["Total", "Sales"]
+            )
+        else:
+            df.at["Total", "Cost %"] = 1
+        workbooks.setdefault(store, []).append((cat, df))
+
+    paths = [os.path.join(OUTPUT_DIR, f"{store}.xlsx") for store in workbooks]
+    with ProcessPoolExecutor() as executor:
+        for path in executor.map(write_store_workbook, paths, workbooks.values()):
+            print(f"Wrote {path}")
+
+    # Record fingerprints only once the workbooks are on disk
+    manifest.update({store: fingerprints[store] for store in changed})
+    with open(MANIFEST_FILE, "w") as f:
+        json.dump(manifest, f, indent=2)
 
     if df_nonetab.empty:
         print("No items to add")
@@ -396,6 +275,8 @@ def main(product_mix_csv, menu_analysis_csv, sort_unit):
     print("Items not in a menu category")
     print(df_nonetab.head(25))
 
+    return paths
+
 
 def get_arguments():
     # creat and argument parser object
@@ -407,25 +288,41 @@ def get_arguments():
     parser.add_argument(
         "-s", "--sales", help="Sort results by sales", action="store_true"
     )
+    parser.add_argument(
+        "--force",
+        help="Rebuild every store's workbook, changed or not",
+        action="store_true",
+    )
+    parser.add_argument("-y", "--year", type=int, help="Fiscal year")
+    parser.add_argument("-p", "--period", type=int, help="Fiscal period")
+    parser.add_argument("-w", "--week", type=int, help="Fiscal week")
     args = parser.parse_args()
 
     # must have a sort unit
     if args.sales:
-        return "Sales"
+        args.sort_unit = "Sales"
     elif args.quantity:
-        return "Qty"
+        args.sort_unit = "Qty"
     else:
         print("No sort unit provided, sort will be by Sales Total")
-        return "Sales"
+        args.sort_unit = "Sales"
 
+    return args
 
-if __name__ == "__main__":
-    sort_unit = get_arguments()
 
-    product_mix = "./downloads/Product Mix.csv"
-    menu_price_analysis = "./downloads/Menu Price Analysis.csv"
-    main(product_mix, menu_price_analysis, sort_unit)
+if __name__ == "__main__":
+    args = get_arguments()
 
-    os.system(
-        "cp /home/wandored/Projects/menu-engineering/output/*.xlsx /home/wandored/Sync/ReportData/"
-    )
+    if args.year and args.period and args.week:
+        # Build from toast_product_mix and recipe_cost in one query
+        with DatabaseConnection() as db:
+            df_menu = read_db_menu(db, args.year, args.period, args.week)
+    else:
+        product_mix = "./downloads/Product Mix.csv"
+        menu_price_analysis = "./downloads/Menu Price Analysis.csv"
+        df_menu = read_csv_menu(product_mix, menu_price_analysis)
+    written = main(df_menu, args.sort_unit, force=args.force)
+
+    # Sync only the workbooks rebuilt on this run
+    for path in written:
+        shutil.copy2(path, SYNC_DIR)
@@ -12,7 +12,8 @@ import argparse
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from db_utils.dbconnect import DatabaseConnection
-from db_utils.toast_utils import ToastClient
+from db_utils.menu_utils import remove_excluded
+from db_utils.toast_utils import concurrent_map, get_toast_client
 from db_utils.r365_utils import R365Client
 from db_utils.r365_importers import get_daily_sales
 
@@ -47,6 +48,24 @@ def get_start_date(year, period, week):
     return result[0]
 
 
+# The mapping report's own modifier and service-line rules, narrower than
+# DEFAULT_EXCLUDE_PATTERNS so it keeps showing the same unmapped items
+MAPPING_EXCLUDE_PATTERNS = (
+    r"^No ",
+    r"^Seat ",
+    r"^& ",
+    r"^Splash ",
+    r" Allergy$",
+    r"for Salad$",
+    r"for Steak$",
+    r"for Sand$",
+    r"for Taco$",
+    r" Catering$",
+    r"for Cali-Club$",
+    r"for Edge$",
+)
+
+
 def clean_data(toast_export, r365_export):
     # remove rows with any value in Category1, Category2 or Category3 columns from r365_export
     unmapped_menu_items = r365_export[
@@ -60,45 +79,31 @@ def clean_data(toast_export, r365_export):
     new_menu_items = new_menu_items.sort_values(by=["name"], ascending=[True])
     # remove duplicates from the new file
     new_menu_items = new_menu_items.drop_duplicates("name")
-    new_menu_items = new_menu_items[
-        ~new_menu_items["name"].isin(pd.read_csv("./specialty.txt", header=None)[0])
-    ]
-    # drop all items that being with "No " or "Seat " from the new file
-    new_menu_items = new_menu_items[~new_menu_items["name"].str.startswith("No ")]
-    new_menu_items = new_menu_items[~new_menu_items["name"].str.startswith("Seat ")]
-    new_menu_items = new_menu_items[~new_menu_items["name"].str.startswith("& ")]
-    new_menu_items = new_menu_items[~new_menu_items["name"].str.startswith("Splash ")]
-    new_menu_items = new_menu_items[~new_menu_items["name"].str.endswith(" Allergy")]
-    new_menu_items = new_menu_items[~new_menu_items["name"].str.endswith("for Salad")]
-    new_menu_items = new_menu_items[~new_menu_items["name"].str.endswith("for Steak")]
-    new_menu_items = new_menu_items[~new_menu_items["name"].str.endswith("for Sand")]
-    new_menu_items = new_menu_items[~new_menu_items["name"].str.endswith("for Taco")]
-    new_menu_items = new_menu_items[~new_menu_items["name"].str.endswith(" Catering")]
-    new_menu_items = new_menu_items[
-        ~new_menu_items["name"].str.endswith("for Cali-Club")
-    ]
-    new_menu_items = new_menu_items[~new_menu_items["name"].str.endswith("for Edge")]
+    # drop specialty items, modifiers, splashes and catering lines
+    new_menu_items = remove_excluded(
+        new_menu_items, "name", patterns=MAPPING_EXCLUDE_PATTERNS
+    )
 
     return new_menu_items
 
 
+def get_location_menu_items(location_guid, client):
+    response = client.get_response_data("/config/v2/menuItems/", location_guid)
+    return [{"guid": item.get("guid"), "name": item.get("name")} for item in response]
+
+
 def get_toast_menu_item_list():
-    client = ToastClient()
+    client = get_toast_client()
 
     locations = client.get_restaurants()
 
-    # collect all menu guids for each location guid
-    toast_menu_items = pd.DataFrame()
-    for location_guid in locations:
-        url = "/config/v2/menuItems/"
-        response = client.get_response_data(url, location_guid)
-        location_menu_items = pd.DataFrame(response)
-        location_menu_items = location_menu_items[["guid", "name"]]
-        location_menu_items.to_csv("./output/toast_menu_items.csv", index=False)
-
-        toast_menu_items = pd.concat(
-            [toast_menu_items, location_menu_items], ignore_index=True
-        )
+    # collect menu items for every location, then build a single frame
+    results = concurrent_map(get_location_menu_items, locations, client)
+    toast_menu_items = pd.DataFrame(
+        [row for rows in results for row in rows], columns=["guid", "name"]
+    )
+    toast_menu_items.to_csv("./output/toast_menu_items.csv", index=False)
+
     toast_menu_items = toast_menu_items.drop_duplicates("name")
     return toast_menu_items
 
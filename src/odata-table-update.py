@@ -16,7 +16,10 @@ from db_utils.r365_utils import R365Client
 
 
 def update_glaccount(db, client):
-    payload = get_glaccounts(client)
+    payload = get_glaccounts(client, validator_key="glaccount")
+    if payload is None:
+        logging.info("GlAccount table unchanged, skipping update")
+        return 0
     df = pd.DataFrame(
         [
             {
@@ -33,18 +36,24 @@ def update_glaccount(db, client):
     records = df[["glaccountid", "name", "glaccountnumber", "gltype"]].values.tolist()
 
     try:
-        db.executemany(
-            """
-            INSERT INTO glaccount (glaccountid, name, glaccountnumber, gltype)
-            VALUES %s
-            ON CONFLICT (glaccountid) DO UPDATE
-            SET name = EXCLUDED.name,
-                glaccountnumber = EXCLUDED.glaccountnumber,
-                gltype = EXCLUDED.gltype
-            """,
+        inserted, updated, unchanged = db.upsert_changed(
+            "glaccount",
+            [
+                "glaccountid",
+                "name",
+                "glaccountnumber",
+                "gltype",
+            ],
+            ["glaccountid"],
             records,
         )
-        logging.info("GlAccount table updated successfully")
+        client.commit_validators("glaccount")
+        logging.info(
+            "GlAccount table updated: %d inserted, %d updated, %d unchanged",
+            inserted,
+            updated,
+            unchanged,
+        )
         return 0
     except Exception as e:
         logging.error("Error writing to database: %s", e)
@@ -119,7 +128,10 @@ def update_jobtitle(db, client):
 
 def update_location(db, client):
 
-    payload = get_locations(client)
+    payload = get_locations(client, validator_key="location")
+    if payload is None:
+        logging.info("Location table unchanged, skipping update")
+        return 0
     df = pd.DataFrame(
         [
             {
@@ -138,17 +150,23 @@ def update_location(db, client):
     df = df.drop_duplicates(subset=["locationid"], keep="last")
     records = df[["locationid", "name", "locationnumber"]].values.tolist()
     try:
-        db.executemany(
-            """
-            INSERT INTO location (locationid, name, locationnumber)
-            VALUES %s
-            ON CONFLICT (locationid) DO UPDATE
-            SET name = EXCLUDED.name,
-                locationnumber = EXCLUDED.locationnumber
-            """,
+        inserted, updated, unchanged = db.upsert_changed(
+            "location",
+            [
+                "locationid",
+                "name",
+                "locationnumber",
+            ],
+            ["locationid"],
             records,
         )
-        logging.info("Location table updated successfully")
+        client.commit_validators("location")
+        logging.info(
+            "Location table updated: %d inserted, %d updated, %d unchanged",
+            inserted,
+            updated,
+            unchanged,
+        )
         return 0
     except Exception as e:
         logging.error("Error writing to database: %s", e)
@@ -173,16 +191,21 @@ def update_company(db, client):
     df = df.drop_duplicates(subset=["companyid"], keep="last")
     records = df[["companyid", "name"]].values.tolist()
     try:
-        db.executemany(
-            """
-            INSERT INTO company (companyid, name)
-            VALUES %s
-            ON CONFLICT (companyid) DO UPDATE
-            SET name = EXCLUDED.name
-            """,
+        inserted, updated, unchanged = db.upsert_changed(
+            "company",
+            [
+                "companyid",
+                "name",
+            ],
+            ["companyid"],
             records,
         )
-        logging.info("Company table updated successfully")
+        logging.info(
+            "Company table updated: %d inserted, %d updated, %d unchanged",
+            inserted,
+            updated,
+            unchanged,
+        )
         return 0
     except Exception as e:
         logging.error("Error writing to database: %s", e)
@@ -190,7 +213,10 @@ def update_company(db, client):
 
 
 def update_item(db, client):
-    payload = get_purchase_items(client)
+    payload = get_purchase_items(client, validator_key="item")
+    if payload is None:
+        logging.info("Item table unchanged, skipping update")
+        return 0
     df = pd.DataFrame(
         [
             {
@@ -216,19 +242,25 @@ def update_item(db, client):
         ["itemid", "name", "category1", "category2", "category3"]
     ].values.tolist()
     try:
-        db.executemany(
-            """
-            INSERT INTO item (itemid, name, category1, category2, category3)
-            VALUES %s
-            ON CONFLICT (itemid) DO UPDATE
-            SET name = EXCLUDED.name,
-                category1 = EXCLUDED.category1,
-                category2 = EXCLUDED.category2,
-                category3 = EXCLUDED.category3
-            """,
+        inserted, updated, unchanged = db.upsert_changed(
+            "item",
+            [
+                "itemid",
+                "name",
+                "category1",
+                "category2",
+                "category3",
+            ],
+            ["itemid"],
             records,
         )
-        logging.info("Item table updated successfully")
+        client.commit_validators("item")
+        logging.info(
+            "Item table updated: %d inserted, %d updated, %d unchanged",
+            inserted,
+            updated,
+            unchanged,
+        )
         return 0
     except Exception as e:
         logging.error("Error writing to database: %s", e)
@@ -271,21 +303,26 @@ def update_sales_accounts(db, client):
         ]
     ].values.tolist()
     try:
-        db.executemany(
-            """
-            INSERT INTO sales_accounts (sales_account_id, name, sales_category, gl_account, sales_account_type, service_type, day_part)
-            VALUES %s
-            ON CONFLICT (sales_account_id) DO UPDATE
-            SET name = EXCLUDED.name,
-                sales_category = EXCLUDED.sales_category,
-                gl_account = EXCLUDED.gl_account,
-                sales_account_type = EXCLUDED.sales_account_type,
-                service_type = EXCLUDED.service_type,
-                day_part = EXCLUDED.day_part
-            """,
+        inserted, updated, unchanged = db.upsert_changed(
+            "sales_accounts",
+            [
+                "sales_account_id",
+                "name",
+                "sales_category",
+                "gl_account",
+                "sales_account_type",
+                "service_type",
+                "day_part",
+            ],
+            ["sales_account_id"],
             records,
         )
-        logging.info("sales_accounts table updated successfully")
+        logging.info(
+            "sales_accounts table updated: %d inserted, %d updated, %d unchanged",
+            inserted,
+            updated,
+            unchanged,
+        )
         return 0
     except Exception as e:
         logging.error("Error writing to database: %s", e)
@@ -16,7 +16,10 @@ from db_utils.r365_importers import get_purchase_items
 
 def main():
     client = R365Client()
-    purchase_items_data = get_purchase_items(client)
+    purchase_items_data = get_purchase_items(client, validator_key="purchase_item")
+    if purchase_items_data is None:
+        logging.info("purchase_item unchanged, skipping upload")
+        return
 
     PurchaseItems = pd.DataFrame(
         [
@@ -93,52 +96,39 @@ def main():
 
     with DatabaseConnection() as db:
         try:
-            db.executemany(
-                """
-                INSERT INTO purchase_item (
-                    item_id,
-                    item_name,
-                    reporting_uofm,
-                    inventory_uofm,
-                    category1,
-                    category2,
-                    category3,
-                    cost_account,
-                    inventory_account,
-                    waste_account,
-                    key_item,
-                    weight_qty,
-                    weight_uofm,
-                    volume_qty,
-                    volume_uofm,
-                    each_qty,
-                    each_uofm,
-                    measure_type,
-                    active
-                )
-                VALUES %s
-                ON CONFLICT (item_id) DO UPDATE
-                SET item_name = EXCLUDED.item_name,
-                    reporting_uofm = EXCLUDED.reporting_uofm,
-                    inventory_uofm = EXCLUDED.inventory_uofm,
-                    category1 = EXCLUDED.category1,
-                    category2 = EXCLUDED.category2,
-                    category3 = EXCLUDED.category3,
-                    cost_account = EXCLUDED.cost_account,
-                    inventory_account = EXCLUDED.inventory_account,
-                    waste_account = EXCLUDED.waste_account,
-                    key_item = EXCLUDED.key_item,
-                    weight_qty = EXCLUDED.weight_qty,
-                    weight_uofm = EXCLUDED.weight_uofm,
-                    volume_qty = EXCLUDED.volume_qty,
-                    volume_uofm = EXCLUDED.volume_uofm,
-                    each_qty = EXCLUDED.each_qty,
-                    each_uofm = EXCLUDED.each_uofm,
-                    measure_type = EXCLUDED.measure_type,
-                    active = EXCLUDED.active
-                """,
+            inserted, updated, unchanged = db.upsert_changed(
+                "purchase_item",
+                [
+                    "item_id",
+                    "item_name",
+                    "reporting_uofm",
+                    "inventory_uofm",
+                    "category1",
+                    "category2",
+                    "category3",
+                    "cost_account",
+                    "inventory_account",
+                    "waste_account",
+                    "key_item",
+                    "weight_qty",
+                    "weight_uofm",
+                    "volume_qty",
+                    "volume_uofm",
+                    "each_qty",
+                    "each_uofm",
+                    "measure_type",
+                    "active",
+                ],
+                ["item_id"],
                 records,
             )
+            logging.info(
+                "purchase_item updated: %d inserted, %d updated, %d unchanged",
+                inserted,
+                updated,
+                unchanged,
+            )
+            client.commit_validators("purchase_item")
         except UniqueViolation as e:
             logging.error(f"Unique violation error: {e}")
         except Exception as e:
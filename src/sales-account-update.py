@@ -50,20 +50,23 @@ def update_sales_account_table(csv_path: str):
                 "day_part",
             ]
         ].values.tolist()
-        db.executemany(
-            """
-            INSERT INTO sales_accounts (sales_account_id, name, sales_category, gl_account, sales_account_type, service_type, day_part)
-            VALUES %s
-            ON CONFLICT (sales_account_id) DO UPDATE
-            SET name = EXCLUDED.name,
-                sales_category = EXCLUDED.sales_category,
-                gl_account = EXCLUDED.gl_account,
-                sales_account_type = EXCLUDED.sales_account_type,
-                service_type = EXCLUDED.service_type,
-                day_part = EXCLUDED.day_part
-            """,
+        inserted, updated, unchanged = db.upsert_changed(
+            "sales_accounts",
+            [
+                "sales_account_id",
+                "name",
+                "sales_category",
+                "gl_account",
+                "sales_account_type",
+                "service_type",
+                "day_part",
+            ],
+            ["sales_account_id"],
             records,
         )
+        print(
+            f"sales_accounts: {inserted} inserted, {updated} updated, {unchanged} unchanged"
+        )
 
 
 if __name__ == "__main__":
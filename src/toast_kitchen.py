@@ -1,44 +1,29 @@
 import pandas as pd
 import argparse
 from db_utils.config import Config
-from db_utils.toast_utils import ToastClient
-from db_utils.dbconnect import DatabaseConnection
-
-
-def get_locations(cur) -> pd.DataFrame:
-    cur.execute(
-        """
-        SELECT id, name, toast_guid
-        FROM restaurants
-        WHERE email IS NOT Null
-        ORDER BY name
-        """
-    )
-    locations = cur.fetchall()
-
-    return locations
+from db_utils.toast_utils import get_toast_client
 
 
 def get_item_fulfillments(guid, business_date):
-    toast_client = ToastClient()
+    toast_client = get_toast_client()
     url = "/kitchen/v1/export/itemFulfillments"
     query = {"businessDate": business_date}
 
     response = toast_client.get_response_data(url, guid, params=query)
 
     fulfillment_df = pd.json_normalize(response)
-    print(fulfillment_df)
+    return fulfillment_df
 
 
 def get_prep_stations(guid, business_date):
-    toast_client = ToastClient()
+    toast_client = get_toast_client()
     url = "/kitchen/v1/published/prepStations"
     query = {"lastModified": business_date}
 
     response = toast_client.get_response_data(url, guid, params=query)
 
     prep_stations_df = pd.json_normalize(response)
-    print(prep_stations_df)
+    return prep_stations_df
 
 
 def get_arguments():
@@ -63,14 +48,12 @@ def get_arguments():
 def main():
     business_date = get_arguments()
 
-    with DatabaseConnection() as db:
-        locations = get_locations(db.cur)
-
-    fulfillment_df = pd.DataFrame()
-    for loc in locations:
-        guid = loc["toast_guid"]
-        # location_fulfillment = get_item_fulfillments(guid, business_date)
-        get_prep_stations(guid, business_date)
+    client = get_toast_client()
+    prep_stations = client.map_locations(
+        lambda loc: get_prep_stations(loc["toast_guid"], business_date)
+    )
+    for prep_stations_df in prep_stations:
+        print(prep_stations_df)
 
 
 if __name__ == "__main__":
@@ -1,26 +1,11 @@
 import pandas as pd
 import argparse
 from db_utils.config import Config
-from db_utils.toast_utils import ToastClient
-from db_utils.dbconnect import DatabaseConnection
-
-
-def get_locations(cur) -> pd.DataFrame:
-    cur.execute(
-        """
-        SELECT id, name, toast_guid
-        FROM restaurants
-        WHERE email IS NOT Null
-        ORDER BY name
-        """
-    )
-    locations = cur.fetchall()
-
-    return locations
+from db_utils.toast_utils import concurrent_map, get_toast_client
 
 
 def get_payment_identifiers(guid, business_date):
-    toast_client = ToastClient()
+    toast_client = get_toast_client()
     # Return a combined list of the GUIDs for each payment type made during one restaurant business day.
     guid_list = []
     for payment_type in ["paid", "refund", "void"]:
@@ -34,21 +19,70 @@ def get_payment_identifiers(guid, business_date):
     return guid_list
 
 
-def get_payment_report(guid, payment_id_list):
-    toast_client = ToastClient()
-    # For each payment GUID, get the detailed report and combine into a single dataframe.
-    all_payments_df = pd.DataFrame()
-    for i, payment_id in enumerate(payment_id_list):
-        url = f"/orders/v2/payments/{payment_id}"
-        resp = toast_client.get_response_data(url, guid)
-        payment_df = pd.json_normalize(resp)
-        if i == 0:
-            all_payments_df = payment_df
-        else:
-            all_payments_df = pd.concat(
-                [all_payments_df, payment_df], ignore_index=True
-            )
-    return all_payments_df
+def get_payment_detail(payment_id, guid):
+    toast_client = get_toast_client()
+    url = f"/orders/v2/payments/{payment_id}"
+    # A payment detail is a single object, so skip the pagination loop
+    response = toast_client.get(url, guid)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_payment_report(guid, payment_id_list, max_workers=None):
+    # Fetch payment details on a bounded pool, then normalize them in one pass.
+    payments = concurrent_map(
+        get_payment_detail, payment_id_list, guid, max_workers=max_workers
+    )
+    return pd.json_normalize(payments)
+
+
+def get_location_payments(loc, business_date, detail_workers=None):
+    guid = loc["toast_guid"]
+    payment_id_list = get_payment_identifiers(guid, business_date)
+    print(f"Location: {loc['name']} - Found {len(payment_id_list)} payments")
+
+    payment_df = get_payment_report(
+        guid, payment_id_list, max_workers=detail_workers
+    )
+    payment_df["location_name"] = loc["name"]
+    payment_df = payment_df[payment_df["type"] == "CREDIT"]
+    payment_df = payment_df[
+        ~payment_df["cardEntryMode"].isin(
+            [
+                "EMV_CHIP_SIGN",
+                "ONLINE",
+                "SAVED_CARD",
+                "PRE_AUTHED",
+                "FUTURE_ORDER",
+                "INCREMENTAL_PRE_AUTHED",
+            ]
+        )
+    ]
+    payment_df = payment_df[
+        [
+            "guid",
+            "originalProcessingFee",
+            "isProcessedOffline",
+            "type",
+            "checkGuid",
+            "paidDate",
+            "last4Digits",
+            "refund",
+            "refundStatus",
+            "orderGuid",
+            "cardEntryMode",
+            "paymentStatus",
+            "amount",
+            "tipAmount",
+            "amountTendered",
+            "cardType",
+            "houseAccount",
+            "server.guid",
+            "lastModifiedDevice.id",
+            "location_name",
+        ]
+    ]
+    return payment_df
 
 
 def main():
@@ -61,6 +95,11 @@ def main():
         type=str,
         help="Payment business date in YYYYMMDD format",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Concurrent payment-detail requests per location",
+    )
     args = parser.parse_args()
 
     calendar_date = None
@@ -77,59 +116,11 @@ def main():
 
     print(f"Generating report for business date: {calendar_date}")
 
-    with DatabaseConnection() as db:
-        locations = get_locations(db.cur)
-
-    master_df = pd.DataFrame()
-    for loc in locations:
-        guid = loc["toast_guid"]
-        payment_id_list = get_payment_identifiers(guid, business_date)
-        print(f"Location: {loc['name']} - Found {len(payment_id_list)} payments")
-
-        payment_df = get_payment_report(guid, payment_id_list)
-        payment_df["location_name"] = loc["name"]
-        payment_df = payment_df[payment_df["type"] == "CREDIT"]
-        payment_df = payment_df[
-            ~payment_df["cardEntryMode"].isin(
-                [
-                    "EMV_CHIP_SIGN",
-                    "ONLINE",
-                    "SAVED_CARD",
-                    "PRE_AUTHED",
-                    "FUTURE_ORDER",
-                    "INCREMENTAL_PRE_AUTHED",
-                ]
-            )
-        ]
-        payment_df = payment_df[
-            [
-                "guid",
-                "originalProcessingFee",
-                "isProcessedOffline",
-                "type",
-                "checkGuid",
-                "paidDate",
-                "last4Digits",
-                "refund",
-                "refundStatus",
-                "orderGuid",
-                "cardEntryMode",
-                "paymentStatus",
-                "amount",
-                "tipAmount",
-                "amountTendered",
-                "cardType",
-                "houseAccount",
-                "server.guid",
-                "lastModifiedDevice.id",
-                "location_name",
-            ]
-        ]
-
-        if master_df.empty:
-            master_df = payment_df
-        else:
-            master_df = pd.concat([master_df, payment_df], ignore_index=True)
+    client = get_toast_client()
+    location_dfs = client.map_locations(
+        get_location_payments, business_date, detail_workers=args.workers
+    )
+    master_df = pd.concat(location_dfs, ignore_index=True)
 
     master_df.to_csv(file_name, index=False)
     print(f"Report saved to {file_name}")
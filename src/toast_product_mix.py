@@ -8,17 +8,25 @@ The table is designed for power bi to analyze product mix trends, profitability,
 and inventory management across locations and time periods.
 """
 
+import gzip
+import json
+import os
 import re
+import numpy as np
 import pandas as pd
 import argparse
+import multiprocessing
 import pprint
+from array import array
 
 from pandas._libs.tslibs.timedeltas import disallow_ambiguous_unit
 from db_utils.config import Config
 from db_utils.dbconnect import DatabaseConnection
-from db_utils.toast_utils import ToastClient
+from db_utils.menu_utils import PrefixIndex, remove_excluded
+from db_utils.toast_utils import get_toast_client
 from collections import defaultdict, Counter
-from datetime import datetime, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, time, timedelta
 from zoneinfo import ZoneInfo
 
 eastern = ZoneInfo("America/New_York")
@@ -43,23 +51,28 @@ def format_r365_datetime(date_obj, tz_name, hour=4):
     return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + dt.strftime("%z")
 
 
-def get_product_mix(client, guid, business_date=None, start_date=None, end_date=None):
-    if business_date:
-        business_date = pd.to_datetime(business_date).strftime("%Y%m%d")
-
-    url = "/orders/v2/ordersBulk"
-    query = {
-        "businessDate": business_date,
-        "startDate": start_date,
-        "endDate": end_date,
-    }
-
-    payload = client.get_paged_response_data(url, guid, params=query)
-
-    rows = []
-    part_a_names = set()
-
-    def add_row(
+class ProductMixAccumulator:
+    """
+    Aggregates product-mix lines by (item_guid, date, item_name) as they arrive.
+
+    Each distinct key gets one slot in a set of typed column arrays, so memory
+    grows with the number of distinct items rather than the number of orders.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.item_guid = []
+        self.date = []
+        self.item_name = []
+        self.qty_sold = array("d")
+        self.menu_price_total = array("d")
+        self.line_count = array("q")
+        self.gross_item_amt = array("d")
+        self.net_item_amt = array("d")
+        self.discount_amt = array("d")
+
+    def add(
+        self,
         item_guid,
         order_date,
         item_name,
@@ -69,149 +82,260 @@ def get_product_mix(client, guid, business_date=None, start_date=None, end_date=
         net=0,
         discount=0,
     ):
-        rows.append(
+        key = (item_guid, order_date, item_name)
+        i = self.index.get(key)
+        if i is None:
+            i = len(self.item_guid)
+            self.index[key] = i
+            self.item_guid.append(item_guid)
+            self.date.append(order_date)
+            self.item_name.append(item_name)
+            for column in (
+                self.qty_sold,
+                self.menu_price_total,
+                self.gross_item_amt,
+                self.net_item_amt,
+                self.discount_amt,
+            ):
+                column.append(0.0)
+            self.line_count.append(0)
+
+        self.qty_sold[i] += qty
+        self.menu_price_total[i] += menu
+        self.line_count[i] += 1
+        self.gross_item_amt[i] += gross
+        self.net_item_amt[i] += net
+        self.discount_amt[i] += discount
+
+    def to_frame(self):
+        df = pd.DataFrame(
             {
-                "item_guid": item_guid,
-                "date": order_date,
-                "item_name": item_name,
-                "qty_sold": qty,
-                "menu_item_price": menu,
-                "gross_item_amt": gross,
-                "net_item_amt": net,
-                "discount_amt": discount,
+                "item_guid": self.item_guid,
+                "date": self.date,
+                "item_name": self.item_name,
+                "qty_sold": np.array(self.qty_sold),
+                # menu_item_price is the mean over the aggregated lines
+                "menu_item_price": np.array(self.menu_price_total)
+                / np.maximum(np.array(self.line_count, dtype=np.int64), 1),
+                "gross_item_amt": np.array(self.gross_item_amt),
+                "net_item_amt": np.array(self.net_item_amt),
+                "discount_amt": np.array(self.discount_amt),
             }
         )
+        return df.sort_values(["item_name", "item_guid", "date"], ignore_index=True)
+
+
+def sum_discounts(line):
+    return sum(d.get("discountAmount", 0) or 0 for d in line.get("appliedDiscounts", []))
+
 
+def add_modifiers(mix, modifiers, order_date):
     # Recursive function to process modifiers
-    def process_modifiers(modifiers, order_date):
-        for mod in modifiers or []:
-            mod_item = mod.get("item")
-            if not mod_item:
+    for mod in modifiers or []:
+        mod_item = mod.get("item")
+        if not mod_item:
+            continue
+
+        mix.add(
+            item_guid=mod_item["guid"],
+            order_date=order_date,
+            item_name=mod.get("displayName", "Unknown Modifier"),
+            qty=mod.get("quantity", 0) or 0,
+            menu=mod.get("receiptLinePrice", 0) or 0,
+            gross=mod.get("preDiscountPrice", 0) or 0,
+            net=mod.get("price", 0) or 0,
+            discount=sum_discounts(mod),
+        )
+
+        add_modifiers(mix, mod.get("modifiers", []), order_date)
+
+
+def add_order(mix, order, part_a_names):
+    """Fold one ordersBulk order into the accumulator."""
+    order_date = order["businessDate"]
+
+    for check in order.get("checks", []):
+        for sel in check.get("selections", []):
+            if sel.get("voided"):
                 continue
 
-            add_row(
-                item_guid=mod_item["guid"],
-                order_date=order_date,
-                item_name=mod.get("displayName", "Unknown Modifier"),
-                qty=mod.get("quantity", 0) or 0,
-                menu=mod.get("receiptLinePrice", 0) or 0,
-                gross=mod.get("preDiscountPrice", 0) or 0,
-                net=mod.get("price", 0) or 0,
-                discount=sum(
-                    d.get("discountAmount", 0) or 0
-                    for d in mod.get("appliedDiscounts", [])
-                ),
-            )
+            item = sel.get("item")
+            if not item:
+                continue
 
-            process_modifiers(mod.get("modifiers", []), order_date)
+            item_guid = item.get("guid")
+            if not item_guid:
+                continue
 
-    for order in payload:
-        order_date = order["businessDate"]
+            item_name = sel.get("displayName", "Unknown Item")
 
-        for check in order.get("checks", []):
-            for sel in check.get("selections", []):
-                if sel.get("voided"):
-                    continue
+            # Check if any modifiers have "optionGroupPricingMode" set to "REPLACES_PRICE"
+            # This indicates that the item has size/price modifiers that replace the base price.
+            has_size_price = any(
+                mod.get("optionGroupPricingMode") == "REPLACES_PRICE"
+                for mod in sel.get("modifiers", [])
+            )
 
-                item = sel.get("item")
-                if not item:
-                    continue
+            if has_size_price:
+                part_a_names.add(item_name)
+                discount = sum_discounts(sel)
 
-                item_guid = item.get("guid")
-                if not item_guid:
-                    continue
+                for mod in sel.get("modifiers", []):
+                    if mod.get("price", 0) == 0:
+                        continue
 
-                item_name = sel.get("displayName", "Unknown Item")
-                qty = sel.get("quantity", 0) or 0
-                menu = sel.get("receiptLinePrice", 0) or 0
-                gross = sel.get("preDiscountPrice", 0) or 0
-                net = sel.get("price", 0) or 0
-                discount = sum(
-                    d.get("discountAmount", 0) or 0
-                    for d in sel.get("appliedDiscounts", [])
-                )
+                    mod_item = mod.get("item")
+                    if not mod_item:
+                        continue
 
-                # Check if any modifiers have "optionGroupPricingMode" set to "REPLACES_PRICE"
-                # This indicates that the item has size/price modifiers that replace the base price.
-                has_size_price = any(
-                    mod.get("optionGroupPricingMode") == "REPLACES_PRICE"
-                    for mod in sel.get("modifiers", [])
-                )
+                    mod_qty = mod.get("quantity", 0) or 0
+                    if mod_qty == 0:
+                        continue
+
+                    mod_gross = mod.get("preDiscountPrice", 0) or 0
+                    mod_net = mod.get("price", 0) or 0
 
-                if has_size_price:
-                    part_a_names.add(item_name)
-
-                    for mod in sel.get("modifiers", []):
-                        if mod.get("price", 0) == 0:
-                            continue
-
-                        mod_item = mod.get("item")
-                        if not mod_item:
-                            continue
-
-                        mod_qty = mod.get("quantity", 0) or 0
-                        if mod_qty == 0:
-                            continue
-
-                        mod_gross = mod.get("preDiscountPrice", 0) or 0
-                        mod_net = mod.get("price", 0) or 0
-                        discount = sum(
-                            d.get("discountAmount", 0) or 0
-                            for d in sel.get("appliedDiscounts", [])
-                        )
-
-                        add_row(
-                            item_guid=mod_item["guid"],
-                            order_date=order_date,
-                            item_name=f"{item_name} {mod.get('displayName')}",
-                            qty=mod_qty,
-                            menu=mod_gross / mod_qty if mod_qty else 0,
-                            gross=mod_gross,
-                            net=mod_net,
-                            discount=discount,
-                        )
-
-                else:
-                    add_row(
-                        item_guid=item_guid,
+                    mix.add(
+                        item_guid=mod_item["guid"],
                         order_date=order_date,
-                        item_name=item_name,
-                        qty=qty,
-                        menu=menu,
-                        gross=gross,
-                        net=net,
+                        item_name=f"{item_name} {mod.get('displayName')}",
+                        qty=mod_qty,
+                        menu=mod_gross / mod_qty if mod_qty else 0,
+                        gross=mod_gross,
+                        net=mod_net,
                         discount=discount,
                     )
 
-                    process_modifiers(sel.get("modifiers", []), order_date)
+            else:
+                mix.add(
+                    item_guid=item_guid,
+                    order_date=order_date,
+                    item_name=item_name,
+                    qty=sel.get("quantity", 0) or 0,
+                    menu=sel.get("receiptLinePrice", 0) or 0,
+                    gross=sel.get("preDiscountPrice", 0) or 0,
+                    net=sel.get("price", 0) or 0,
+                    discount=sum_discounts(sel),
+                )
 
-    df = pd.DataFrame(rows)
-    if not df.empty:
-        df = (
-            df.groupby(
-                ["item_guid", "date", "item_name"],
-                as_index=False,
-            )
-            .agg(
-                {
-                    "qty_sold": "sum",
-                    "menu_item_price": "mean",
-                    "gross_item_amt": "sum",
-                    "net_item_amt": "sum",
-                    "discount_amt": "sum",
-                }
+                add_modifiers(mix, sel.get("modifiers", []), order_date)
+
+
+ARCHIVE_DIR = Config.BASE_OUTPUT_DIR / "toast_orders"
+
+
+def archive_path(guid, business_date):
+    """Archive file for one location's orders on one business date (YYYYMMDD)."""
+    return ARCHIVE_DIR / str(business_date) / f"{guid}.jsonl.gz"
+
+
+class OrderArchive:
+    """
+    Writes raw ordersBulk orders to gzip JSON-lines files, one per business date.
+
+    Files are written under a temporary name and only replace the archived
+    copy when the fetch completes, so an interrupted pull never leaves a
+    partial day behind. If dates is given, orders outside it are not archived.
+    """
+
+    def __init__(self, guid, dates=None):
+        self.guid = guid
+        self.dates = dates
+        self.files = {}
+
+    def write(self, order):
+        business_date = order.get("businessDate")
+        if business_date is None:
+            return
+        if self.dates is not None and business_date not in self.dates:
+            return
+
+        entry = self.files.get(business_date)
+        if entry is None:
+            path = archive_path(self.guid, business_date)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + ".tmp")
+            entry = self.files[business_date] = (
+                path,
+                tmp_path,
+                gzip.open(tmp_path, "wt", encoding="utf-8"),
             )
-            .sort_values("item_name")
-        )
 
-    return df, part_a_names
+        entry[2].write(json.dumps(order, separators=(",", ":")) + "\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for path, tmp_path, file in self.files.values():
+            file.close()
+            if exc_type is None:
+                os.replace(tmp_path, path)
+            else:
+                os.remove(tmp_path)
+        self.files = {}
+
+
+def archive_dates(start_date, end_date):
+    """Business dates from start_date through end_date as YYYYMMDD ints."""
+    return {
+        int(day.strftime("%Y%m%d"))
+        for day in pd.date_range(start_date, end_date, freq="D")
+    }
+
+
+def get_archived_product_mix(guid, dates):
+    """Rebuild one location's product mix from archived orders; no network."""
+    mix = ProductMixAccumulator()
+    part_a_names = set()
+    for business_date in sorted(dates):
+        path = archive_path(guid, business_date)
+        if not path.exists():
+            print(f"{guid} {business_date}: no archived orders")
+            continue
+
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            for line in file:
+                add_order(mix, json.loads(line), part_a_names)
+
+    return mix.to_frame(), part_a_names
+
+
+def rebuild_location(loc, dates):
+    df, part_a_names = get_archived_product_mix(loc["toast_guid"], dates)
+    return label_location(df, loc), part_a_names
+
+
+ORDERS_BULK_URL = "/orders/v2/ordersBulk"
+
+
+def get_product_mix(
+    client,
+    guid,
+    business_date=None,
+    start_date=None,
+    end_date=None,
+    archive=None,
+):
+    if business_date:
+        business_date = pd.to_datetime(business_date).strftime("%Y%m%d")
+
+    query = {
+        "businessDate": business_date,
+        "startDate": start_date,
+        "endDate": end_date,
+    }
 
+    # Parse ordersBulk page by page; only one page of raw JSON is held at a time
+    mix = ProductMixAccumulator()
+    part_a_names = set()
+    for page in client.iter_paged_response_data(ORDERS_BULK_URL, guid, params=query):
+        for order in page:
+            add_order(mix, order, part_a_names)
+            if archive is not None:
+                archive.write(order)
 
-def extract_part_b(item_name, part_a_names):
-    for part_a in part_a_names:
-        if item_name.startswith(part_a + " "):
-            return item_name[len(part_a) :].strip()
-    return item_name
+    return mix.to_frame(), part_a_names
 
 
 def get_arguments():
@@ -229,41 +353,204 @@ def get_arguments():
     return args.business_date
 
 
-def removeSpecial(df):
-    """Removes specialty items from the dataframe"""
+PRODUCT_MIX_COLUMNS = [
+    "item_guid",
+    "date",
+    "store_id",
+    "item_name",
+    "qty_sold",
+    "menu_item_price",
+    "gross_item_amt",
+    "net_item_amt",
+    "discount_amt",
+]
+
+
+def label_location(df, loc):
+    df["location"] = loc["name"]
+    df["store_id"] = loc["id"]
+
+    df["date"] = pd.to_datetime(
+        df["date"].astype(str),
+        format="%Y%m%d",
+    ).dt.strftime("%Y-%m-%d")
+
+    return df
+
+
+def write_product_mix(db, product_mix, ledger_unit=None):
+    """
+    Upsert product mix rows into toast_product_mix.
+
+    Rows are COPY'd into a temp table and merged with a single
+    INSERT ... ON CONFLICT, all in one transaction. When ledger_unit
+    (store_id, business_date) is given, the unit is marked complete in the
+    same transaction.
+    """
+    # A key may appear more than once (modifier rows share a guid); last one wins
     try:
-        with open("./specialty.txt") as file:
-            specialty_patterns = [line.strip() for line in file if line.strip()]
-    except FileNotFoundError:
-        specialty_patterns = []
-
-    # Remove exact matches
-    if specialty_patterns:
-        df = df[~df.item_name.isin(specialty_patterns)]
-
-    # Combine all regex patterns into one
-    regex_patterns = [
-        r"^No ",
-        r" Only$",
-        r" Tax$",
-        r"^& ",
-        r"^Seat ",
-        r"Allergy$",
-        r"Outstanding$",
-        r"for Salad.*",
-        r".*for Steak.*",
-        r".*for Sand.*",
-        r".*for Taco.*",
-        r".*for Cali-Club.*",
-        r".*for Edge.*",
-        r".*See Server.*",
-        r".*Refund.*",
-        r".*2 Pens.*",
+        merged = db.merge_frame(
+            product_mix[PRODUCT_MIX_COLUMNS],
+            "toast_product_mix",
+            key=["item_guid", "date", "store_id"],
+            now_columns=["last_update"],
+            commit=False,
+        )
+        if ledger_unit is not None:
+            store_id, business_date = ledger_unit
+            db.cur.execute(
+                """
+                INSERT INTO toast_product_mix_ledger (store_id, date, row_count)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (store_id, date) DO UPDATE
+                SET row_count = EXCLUDED.row_count,
+                    completed_at = NOW()
+                """,
+                (store_id, business_date, merged),
+            )
+        db.conn.commit()
+    except Exception:
+        db.conn.rollback()
+        raise
+
+    print(f"Upserted {merged} rows into toast_product_mix")
+
+
+# Toast business dates run until 4am local time (see format_r365_datetime)
+BUSINESS_DAY_CLOSE_HOUR = 4
+
+
+def is_closed(business_date, tz_name):
+    """True once business_date has closed in the store's timezone."""
+    tz = ZoneInfo(tz_name)
+    closes_at = datetime.combine(
+        business_date + timedelta(days=1),
+        time(hour=BUSINESS_DAY_CLOSE_HOUR),
+        tzinfo=tz,
+    )
+    return datetime.now(tz) >= closes_at
+
+
+def get_completed_units(db, start_date, end_date):
+    db.cur.execute(
+        """
+        SELECT store_id, date
+        FROM toast_product_mix_ledger
+        WHERE date BETWEEN %s AND %s
+        """,
+        (start_date, end_date),
+    )
+    return {(row["store_id"], row["date"]) for row in db.cur.fetchall()}
+
+
+def fetch_unit(unit, client):
+    """Pull one (location, business date) unit's orders into the archive."""
+    loc, business_date = unit
+    guid = loc["toast_guid"]
+    dates = archive_dates(business_date, business_date)
+    query = {"businessDate": business_date.strftime("%Y%m%d")}
+
+    orders = 0
+    with OrderArchive(guid, dates) as archive:
+        for page in client.iter_paged_response_data(
+            ORDERS_BULK_URL, guid, params=query
+        ):
+            for order in page:
+                archive.write(order)
+            orders += len(page)
+
+    # Don't let an earlier pull stand in for a day that now has no orders
+    if not orders:
+        archive_path(guid, min(dates)).unlink(missing_ok=True)
+
+
+def load_unit(unit):
+    """
+    Parse one archived unit and commit it; runs in a worker process.
+
+    The unit is only recorded in the ledger when it has rows and its
+    business date has closed, so open or not-yet-posted days are pulled
+    again on the next run.
+    """
+    loc, business_date = unit
+    df, _ = get_archived_product_mix(
+        loc["toast_guid"], archive_dates(business_date, business_date)
+    )
+    if not df.empty:
+        df = remove_excluded(label_location(df, loc), "item_name")
+    if df.empty:
+        print(f"{loc['name']} {business_date}: no rows, not marked complete")
+        return 0
+
+    ledger_unit = None
+    if is_closed(business_date, loc["timezone"]):
+        ledger_unit = (loc["id"], business_date)
+    else:
+        print(f"{loc['name']} {business_date}: business date still open")
+
+    with DatabaseConnection() as db:
+        write_product_mix(db, df, ledger_unit=ledger_unit)
+    return len(df)
+
+
+def run_units(locations, start_date, end_date, jobs, force=False):
+    """
+    Build toast_product_mix as independent (location, business date) units.
+
+    Orders are fetched on Config.TOAST_MAX_WORKERS threads and archived; as
+    each fetch finishes, the unit is parsed and committed on a pool of
+    `jobs` processes, since parsing is CPU bound. Each unit commits on its
+    own, so a failure only loses that unit. Completed units are recorded in
+    toast_product_mix_ledger (db_utils/tables) and skipped on re-runs unless
+    force is set.
+    """
+    with DatabaseConnection() as db:
+        completed = set() if force else get_completed_units(db, start_date, end_date)
+
+    dates = pd.date_range(start_date, end_date, freq="D").date
+    units = [
+        (dict(loc), business_date)
+        for business_date in dates
+        for loc in locations
+        if (loc["id"], business_date) not in completed
     ]
-    combined_pattern = "|".join(f"(?:{pat})" for pat in regex_patterns)
-    df = df[~df.item_name.str.contains(combined_pattern, na=False, regex=True)]
+    print(
+        f"{len(units)} units to process, "
+        f"{len(dates) * len(locations) - len(units)} already complete"
+    )
+    if not units:
+        return
+
+    client = get_toast_client()
+    failed = []
+    # Workers are spawned, not forked, because fetch threads are already running
+    with ThreadPoolExecutor(
+        max_workers=min(Config.TOAST_MAX_WORKERS, len(units))
+    ) as fetchers, ProcessPoolExecutor(
+        max_workers=jobs, mp_context=multiprocessing.get_context("spawn")
+    ) as parsers:
+        fetches = {fetchers.submit(fetch_unit, unit, client): unit for unit in units}
+        loads = {}
+        for future in as_completed(fetches):
+            unit = fetches[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"{unit[0]['name']} {unit[1]}: fetch failed - {e}")
+                failed.append(unit)
+                continue
+            loads[parsers.submit(load_unit, unit)] = unit
 
-    return df
+        for future in as_completed(loads):
+            unit = loads[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"{unit[0]['name']} {unit[1]}: load failed - {e}")
+                failed.append(unit)
+
+    if failed:
+        raise SystemExit(f"{len(failed)} of {len(units)} units failed; re-run to retry")
 
 
 def main():
@@ -288,6 +575,25 @@ def main():
         type=str,
         help="Enter business date in YYYY-MM-DD format",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Process (location, business date) units, parsing them on this "
+        "many worker processes, committing each unit and skipping units "
+        "already completed. "
+        "With --from-archive, the number of worker processes",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="With --jobs, reprocess units already recorded as complete",
+    )
+    parser.add_argument(
+        "--from-archive",
+        action="store_true",
+        help="Rebuild from archived Toast orders instead of calling the API",
+    )
     args = parser.parse_args()
 
     if args.business_date:
@@ -303,82 +609,78 @@ def main():
     with DatabaseConnection() as db:
         locations = get_locations(db.cur)
 
-    client = ToastClient()
+    if args.from_archive:
+        if business_date is not None:
+            dates = archive_dates(business_date, business_date)
+        else:
+            dates = archive_dates(start_date, end_date - pd.Timedelta(days=1))
 
-    product_mix = pd.DataFrame()
-    for loc in locations:
-        if business_date is None:
-            tz = loc["timezone"]
-            request_start = format_r365_datetime(start_date, tz)
-            request_end = format_r365_datetime(end_date, tz)
+        # Parsing archived orders is CPU bound, so use processes, not threads
+        locations = [dict(loc) for loc in locations]
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(
+                executor.map(rebuild_location, locations, [dates] * len(locations))
+            )
+
+    elif args.jobs:
+        if business_date is not None:
+            run_units(locations, business_date, business_date, args.jobs, args.force)
         else:
-            request_start = None
-            request_end = None
-
-        guid = loc["toast_guid"]
-        df, part_a_names = get_product_mix(
-            client,
-            guid,
-            business_date,
-            request_start,
-            request_end,
-        )
+            last_date = end_date - pd.Timedelta(days=1)
+            run_units(locations, start_date, last_date, args.jobs, args.force)
+        return
+
+    else:
+        client = get_toast_client()
+
+        def fetch_location(loc):
+            if business_date is None:
+                tz = loc["timezone"]
+                request_start = format_r365_datetime(start_date, tz)
+                request_end = format_r365_datetime(end_date, tz)
+                dates = archive_dates(start_date, end_date - pd.Timedelta(days=1))
+            else:
+                request_start = None
+                request_end = None
+                dates = None
+
+            guid = loc["toast_guid"]
+            with OrderArchive(guid, dates) as archive:
+                df, part_a_names = get_product_mix(
+                    client,
+                    guid,
+                    business_date,
+                    request_start,
+                    request_end,
+                    archive=archive,
+                )
 
-        df["location"] = loc["name"]
-        df["store_id"] = loc["id"]
+            return label_location(df, loc), part_a_names
 
-        df["date"] = pd.to_datetime(
-            df["date"].astype(str),
-            format="%Y%m%d",
-        ).dt.strftime("%Y-%m-%d")
+        results = client.map_locations(fetch_location, locations=locations)
 
-        product_mix = pd.concat([product_mix, df], ignore_index=True)
+    product_mix = pd.concat([df for df, _ in results], ignore_index=True)
+    part_a_names = set().union(*(names for _, names in results))
 
     # Save original item_name
     product_mix["original_item_name"] = product_mix["item_name"]
-    # Extract Part B for merging
-    product_mix["merge_item_name"] = product_mix["item_name"].apply(
-        lambda x: extract_part_b(x, part_a_names)
+    # Extract Part B for merging; one index covers every location's parents
+    part_a_index = PrefixIndex(part_a_names)
+    product_mix["merge_item_name"] = part_a_index.resolve_series(
+        product_mix["item_name"]
     )
 
     # Restore original item_name
     product_mix["item_name"] = product_mix["original_item_name"]
     product_mix.drop(columns=["original_item_name", "merge_item_name"], inplace=True)
 
-    product_mix = removeSpecial(product_mix)
+    product_mix = remove_excluded(product_mix, "item_name")
     # write product_mix to csv
     product_mix.to_csv(f"./output/product_mix_{business_date}.csv", index=False)
     # product_mix = product_mix[~product_mix["cost"].isnull()]
 
     with DatabaseConnection() as db:
-        for _, row in product_mix.iterrows():
-            db.cur.execute(
-                """
-                INSERT INTO toast_product_mix (item_guid, date, store_id, item_name, qty_sold, menu_item_price, gross_item_amt, net_item_amt, discount_amt)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (item_guid, date, store_id)
-                DO UPDATE SET
-                    item_name = EXCLUDED.item_name,
-                    qty_sold = EXCLUDED.qty_sold,
-                    menu_item_price = EXCLUDED.menu_item_price,
-                    gross_item_amt = EXCLUDED.gross_item_amt,
-                    net_item_amt = EXCLUDED.net_item_amt,
-                    discount_amt = EXCLUDED.discount_amt,
-                    last_update = NOW()
-                """,
-                (
-                    row["item_guid"],
-                    row["date"],
-                    row["store_id"],
-                    row["item_name"],
-                    row["qty_sold"],
-                    row["menu_item_price"],
-                    row["gross_item_amt"],
-                    row["net_item_amt"],
-                    row["discount_amt"],
-                ),
-            )
-        db.conn.commit()
+        write_product_mix(db, product_mix)
 
 
 if __name__ == "__main__":
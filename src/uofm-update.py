@@ -14,7 +14,10 @@ def find_renamed(old, new):
 
 def main():
     client = R365Client()
-    uofm_data = get_units_of_measure(client)
+    uofm_data = get_units_of_measure(client, validator_key="unitsofmeasure")
+    if uofm_data is None:
+        print("unitsofmeasure unchanged, skipping upload")
+        return
 
     uofm = pd.DataFrame(
         [
@@ -72,22 +75,25 @@ def main():
             ]
         ].values.tolist()
 
-        db.executemany(
-            """
-            INSERT INTO unitsofmeasure (uofm_id, name, equivalent_qty, equivalent_uofm, measure_type, base_uofm, base_qty, active)
-            VALUES %s
-            ON CONFLICT (uofm_id) DO UPDATE
-            SET name = EXCLUDED.name,
-                equivalent_qty = EXCLUDED.equivalent_qty,
-                equivalent_uofm = EXCLUDED.equivalent_uofm,
-                measure_type = EXCLUDED.measure_type,
-                base_uofm = EXCLUDED.base_uofm,
-                base_qty = EXCLUDED.base_qty,
-                active = EXCLUDED.active
-            """,
+        inserted, updated, unchanged = db.upsert_changed(
+            "unitsofmeasure",
+            [
+                "uofm_id",
+                "name",
+                "equivalent_qty",
+                "equivalent_uofm",
+                "measure_type",
+                "base_uofm",
+                "base_qty",
+                "active",
+            ],
+            ["uofm_id"],
             records,
         )
-        print("database uploaded")
+        print(
+            f"database uploaded: {inserted} inserted, {updated} updated, {unchanged} unchanged"
+        )
+        client.commit_validators("unitsofmeasure")
 
 
 if __name__ == "__main__":
@@ -5,11 +5,14 @@ Create and populate the last_purchases table from purchases and unitsofmeasure d
 import sys
 import os
 import argparse
+import json
+from datetime import date, datetime, timedelta
+
 import pandas as pd
-from psycopg2.extras import execute_values
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from db_utils.config import Config
 from db_utils.dbconnect import DatabaseConnection
 
 
@@ -30,166 +33,90 @@ def get_end_of_week_date(cur, year, period, week):
         )
 
 
-def calculate_current_cost_per_item(cur, location, end_of_week_date):
-    # calculate the base_cost per item based on the most recent purchase price and unit of measure
-    query = """
-        WITH latest_purchases AS (
-            SELECT
-                p.date,
-                p.store_id,
-                p.item_id,
-                i.name,
-                p.quantity,
-                p.uofm,
-                p.amount,
-                p.base_uofm,
-                p.base_qty,
-                ROW_NUMBER() OVER (PARTITION BY p.item_id ORDER BY p.date DESC) AS rn
-            FROM purchases_pbi p
-            JOIN item i ON p.item_id = i.itemid
-            WHERE p.store_id = %s AND p.date <= %s AND p.category1 in ('Food', 'LBW')
-        )
+# Latest Food/LBW purchase per (store_id, item_id) up to the week end, with the
+# earliest stock count as the fallback when there is no purchase or the
+# purchase carries no cost. Every store comes back from one query.
+WEEK_BASE_COST_QUERY = """
+    WITH stores AS (
+        SELECT id FROM restaurants WHERE toast_id IS NOT NULL
+    ),
+    latest_purchase AS (
+        SELECT DISTINCT ON (p.store_id, p.item_id)
+            p.date,
+            p.store_id,
+            p.item_id,
+            i.name AS item,
+            p.base_uofm,
+            CASE
+                WHEN p.quantity > 0 AND p.base_qty > 0
+                THEN (p.amount / p.quantity) / p.base_qty
+                ELSE 0
+            END AS base_cost
+        FROM purchases_pbi p
+        JOIN item i ON p.item_id = i.itemid
+        WHERE p.store_id IN (SELECT id FROM stores)
+          AND p.date <= %(end_of_week_date)s
+          AND p.category1 IN ('Food', 'LBW')
+        ORDER BY p.store_id, p.item_id, p.date DESC
+    ),
+    first_count AS (
+        SELECT DISTINCT ON (scp.store_id, scp.item_id)
+            scp.date,
+            scp.store_id,
+            scp.item_id,
+            item.name AS item,
+            u.base_uofm,
+            CASE
+                WHEN scp.quantity > 0 AND u.base_qty > 0
+                THEN (scp.amount / scp.quantity) / u.base_qty
+                ELSE 0
+            END AS base_cost
+        FROM stock_count_pbi scp
+        JOIN item ON scp.item_id = item.itemid
+        LEFT JOIN unitsofmeasure u ON u.name = scp.uofm
+        WHERE scp.store_id IN (SELECT id FROM stores)
+          AND scp.date <= %(end_of_week_date)s
+        ORDER BY scp.store_id, scp.item_id, scp.date ASC
+    ),
+    combined AS (
         SELECT
-            date,
-            store_id,
-            item_id,
-            name AS item,
-            quantity,
-            uofm,
-            amount,
-            base_uofm,
-            base_qty
-        FROM latest_purchases
-        WHERE rn = 1
-    """
-    cur.execute(query, (location, end_of_week_date))
-    rows = cur.fetchall()
-    if not rows:
-        print(f"No purchases found for location {location} up to {end_of_week_date}")
-        return pd.DataFrame()  # Return empty DataFrame if no purchases found
-    df = pd.DataFrame(rows, columns=rows[0].keys())
-    df["base_cost"] = df.apply(
-        lambda row: (
-            (row["amount"] / row["quantity"]) / row["base_qty"]
-            if row["quantity"] > 0 and row["base_qty"] > 0
-            else 0
-        ),
-        axis=1,
+            p.store_id AS p_store_id,
+            p.item_id AS p_item_id,
+            p.date AS p_date,
+            p.item AS p_item,
+            p.base_uofm AS p_base_uofm,
+            p.base_cost AS p_base_cost,
+            c.store_id AS c_store_id,
+            c.item_id AS c_item_id,
+            c.date AS c_date,
+            c.item AS c_item,
+            c.base_uofm AS c_base_uofm,
+            c.base_cost AS c_base_cost,
+            p.item_id IS NULL
+                OR (p.base_cost = 0 AND c.item_id IS NOT NULL) AS use_count
+        FROM latest_purchase p
+        FULL OUTER JOIN first_count c
+            ON c.store_id = p.store_id AND c.item_id = p.item_id
     )
-    df = df.drop(columns=["quantity", "uofm", "amount", "base_qty"])
-
-    return df
+    SELECT
+        CASE WHEN use_count THEN c_date ELSE p_date END AS date,
+        COALESCE(p_store_id, c_store_id) AS store_id,
+        CASE WHEN use_count THEN c_item ELSE p_item END AS item,
+        CASE WHEN use_count THEN c_base_uofm ELSE p_base_uofm END AS base_uofm,
+        CASE WHEN use_count THEN c_base_cost ELSE p_base_cost END AS base_cost,
+        COALESCE(p_item_id, c_item_id) AS item_id
+    FROM combined
+"""
 
 
-def get_zero_cost_items_from_stock_count(cur, location, item_ids, end_of_week_date):
-    item_filter = ""
-    params = [location, end_of_week_date]
-    if item_ids:
-        item_filter = " AND scp.item_id = ANY(%s)"
-        params.append(item_ids)
-    query = f"""
-        SELECT date, store_id, item_id, item, quantity, uofm, amount
-        FROM (
-            SELECT
-                scp.date,
-                scp.store_id,
-                scp.item_id,
-                item.name AS item,
-                scp.quantity,
-                scp.uofm,
-                scp.amount,
-                ROW_NUMBER() OVER (PARTITION BY scp.item_id ORDER BY scp.date ASC) AS rn
-            FROM stock_count_pbi scp
-            JOIN item ON scp.item_id = item.itemid
-            WHERE scp.store_id = %s AND scp.date <= %s{item_filter}
-        ) ranked
-        WHERE rn = 1
-    """
-    cur.execute(query, tuple(params))
+def get_week_base_costs(cur, end_of_week_date):
+    cur.execute(WEEK_BASE_COST_QUERY, {"end_of_week_date": end_of_week_date})
     rows = cur.fetchall()
     if not rows:
-        print(
-            f"No stock count entries found for location {location} and items {item_ids} up to {end_of_week_date}"
-        )
-        return pd.DataFrame()  # Return empty DataFrame if no stock count entries found
-    df = pd.DataFrame(rows, columns=rows[0].keys())
-    # merge with unitsofmeasure to get base_uofm
-    uofm_names = df["uofm"].unique().tolist()
-    uofm_query = """
-        SELECT uofm_id, name AS uofm, equivalent_qty, equivalent_uofm, base_uofm, base_qty
-        FROM unitsofmeasure
-        WHERE name = ANY(%s)
-    """
-    cur.execute(uofm_query, (uofm_names,))
-    uofm_rows = cur.fetchall()
-    if not uofm_rows:
-        print(f"No unit of measure entries found for items {item_ids}")
-        return df  # Return the original DataFrame if no unit of measure entries found
-    uofm_df = pd.DataFrame(uofm_rows, columns=uofm_rows[0].keys())
-    df = df.merge(uofm_df, on="uofm", how="left")
-    df["base_cost"] = df.apply(
-        lambda row: (
-            (row["amount"] / row["quantity"]) / row["base_qty"]
-            if row["quantity"] > 0 and row["base_qty"] > 0
-            else 0
-        ),
-        axis=1,
+        print(f"No purchases or stock counts found up to {end_of_week_date}")
+    return pd.DataFrame(
+        rows, columns=["date", "store_id", "item", "base_uofm", "base_cost", "item_id"]
     )
-    df = df.drop(columns=["quantity", "uofm", "amount", "base_qty"])
-    return df
-
-
-# def get_zero_cost_items_from_stock_count(cur, location, item_ids, end_of_week_date):
-#     query = """
-#         SELECT date, store_id, item_id, item, quantity, uofm, amount
-#         FROM (
-#             SELECT
-#                 scp.date,
-#                 scp.store_id,
-#                 scp.item_id,
-#                 item.name AS item,
-#                 scp.quantity,
-#                 scp.uofm,
-#                 scp.amount,
-#                 ROW_NUMBER() OVER (PARTITION BY scp.item_id ORDER BY scp.date ASC) AS rn
-#             FROM stock_count_pbi scp
-#             JOIN item ON scp.item_id = item.itemid
-#             WHERE scp.store_id = %s AND scp.date <= %s AND scp.item_id = ANY(%s)
-#         ) ranked
-#         WHERE rn = 1
-#     """
-#     cur.execute(query, (location, end_of_week_date, item_ids))
-#     rows = cur.fetchall()
-#     if not rows:
-#         print(
-#             f"No stock count entries found for location {location} and items {item_ids} up to {end_of_week_date}"
-#         )
-#         return pd.DataFrame()  # Return empty DataFrame if no stock count entries found
-#     df = pd.DataFrame(rows, columns=rows[0].keys())
-#     # merge with unitsofmeasure to get base_uofm
-#     uofm_names = df["uofm"].unique().tolist()
-#     uofm_query = """
-#         SELECT uofm_id, name AS uofm, equivalent_qty, equivalent_uofm, base_uofm, base_qty
-#         FROM unitsofmeasure
-#         WHERE name = ANY(%s)
-#     """
-#     cur.execute(uofm_query, (uofm_names,))
-#     uofm_rows = cur.fetchall()
-#     if not uofm_rows:
-#         print(f"No unit of measure entries found for items {item_ids}")
-#         return df  # Return the original DataFrame if no unit of measure entries found
-#     uofm_df = pd.DataFrame(uofm_rows, columns=uofm_rows[0].keys())
-#     df = df.merge(uofm_df, on="uofm", how="left")
-#     df["base_cost"] = df.apply(
-#         lambda row: (
-#             (row["amount"] / row["quantity"]) / row["base_qty"]
-#             if row["quantity"] > 0 and row["base_qty"] > 0
-#             else 0
-#         ),
-#         axis=1,
-#     )
-#     df = df.drop(columns=["quantity", "uofm", "amount", "base_qty"])
-#     return df
 
 
 def process_week(db, year, period, week):
@@ -199,184 +126,402 @@ def process_week(db, year, period, week):
     print(
         f"End of week date for year={year}, period={period}, week={week} is {end_of_week_date}"
     )
-    # Get list of locations from restaurants table
-    db.cur.execute("SELECT id FROM restaurants WHERE toast_id IS NOT NULL")
-    store_id = [row["id"] for row in db.cur.fetchall()]
-    weekly_item_base_cost_df = (
-        pd.DataFrame()
-    )  # Initialize an empty DataFrame to store results
-    for id in store_id:
-        location_df: pd.DataFrame = calculate_current_cost_per_item(
-            db.cur, id, end_of_week_date
-        )
-        stock_count_df = get_zero_cost_items_from_stock_count(
-            db.cur, id, None, end_of_week_date
-        )
-        if not stock_count_df.empty:
-            if location_df.empty:
-                location_df = stock_count_df.copy()
-            else:
-                location_item_ids = location_df["item_id"].tolist()
-                location_df = location_df.merge(
-                    stock_count_df,
-                    on="item_id",
-                    how="left",
-                    suffixes=("", "_sc"),
-                    validate="many_to_one",
-                )
-                has_stock_count = location_df["base_cost_sc"].notna()
-                update_mask = (location_df["base_cost"] == 0) & has_stock_count
-                location_df.loc[update_mask, "base_cost"] = location_df.loc[
-                    update_mask, "base_cost_sc"
-                ]
-                location_df.loc[update_mask, "base_uofm"] = location_df.loc[
-                    update_mask, "base_uofm_sc"
-                ]
-                location_df.loc[update_mask, "date"] = location_df.loc[
-                    update_mask, "date_sc"
-                ]
-                location_df.loc[update_mask, "item"] = location_df.loc[
-                    update_mask, "item_sc"
-                ]
-                location_df = location_df.drop(
-                    columns=[
-                        "date_sc",
-                        "store_id_sc",
-                        "item_sc",
-                        "base_uofm_sc",
-                        "base_cost_sc",
-                    ],
-                    errors="ignore",
-                )
-                missing_items = stock_count_df[
-                    ~stock_count_df["item_id"].isin(location_item_ids)
-                ]
-                if not missing_items.empty:
-                    location_df = pd.concat(
-                        [location_df, missing_items], ignore_index=True
-                    )
-        location_df["store_id"] = id
-        location_df["year"] = year
-        location_df["period"] = period
-        location_df["week"] = week
-        location_df["week_index"] = week_index
-        location_df["period_index"] = period_index
-        weekly_item_base_cost_df = pd.concat(
-            [weekly_item_base_cost_df, location_df], ignore_index=True
-        )
+    weekly_item_base_cost_df = get_week_base_costs(db.cur, end_of_week_date)
+    weekly_item_base_cost_df["year"] = year
+    weekly_item_base_cost_df["period"] = period
+    weekly_item_base_cost_df["week"] = week
+    weekly_item_base_cost_df["week_index"] = week_index
+    weekly_item_base_cost_df["period_index"] = period_index
     # drop rows with missing base_uofm
     weekly_item_base_cost_df = weekly_item_base_cost_df.dropna(subset=["base_uofm"])
 
-    # for id in store_id:
-    #     location_df: pd.DataFrame = calculate_current_cost_per_item(
-    #         db.cur, id, end_of_week_date
-    #     )
-    #     # for location_df items that have a base_cost of 0, find the most recent cost in stock_count_pbi
-    #     zero_cost_items = location_df[location_df["base_cost"] == 0]["item_id"].tolist()
-    #     zero_cost_items_df = location_df[location_df["base_cost"] == 0]
-    #     if not zero_cost_items_df.empty:
-    #         zero_cost_items_df = get_zero_cost_items_from_stock_count(
-    #             db.cur, id, zero_cost_items, end_of_week_date
-    #         )
-    #         print(zero_cost_items_df.head())
-    #         if not zero_cost_items_df.empty:
-    #             location_df = location_df.merge(
-    #                 zero_cost_items_df,
-    #                 on="item_id",
-    #                 how="left",
-    #                 suffixes=("", "_sc"),
-    #                 validate="many_to_one",
-    #             )
-    #             has_stock_count = location_df["base_cost_sc"].notna()
-    #             update_mask = (location_df["base_cost"] == 0) & has_stock_count
-    #             location_df.loc[update_mask, "base_cost"] = location_df.loc[
-    #                 update_mask, "base_cost_sc"
-    #             ]
-    #             location_df.loc[update_mask, "base_uofm"] = location_df.loc[
-    #                 update_mask, "base_uofm_sc"
-    #             ]
-    #             location_df.loc[update_mask, "date"] = location_df.loc[
-    #                 update_mask, "date_sc"
-    #             ]
-    #             location_df.loc[update_mask, "item"] = location_df.loc[
-    #                 update_mask, "item_sc"
-    #             ]
-    #             location_df = location_df.drop(
-    #                 columns=[
-    #                     "date_sc",
-    #                     "store_id_sc",
-    #                     "item_sc",
-    #                     "base_uofm_sc",
-    #                     "base_cost_sc",
-    #                 ],
-    #                 errors="ignore",
-    #             )
-    #         print(location_df[location_df["item_id"].isin(zero_cost_items)].head())
-    #
-    #     location_df["store_id"] = id
-    #     location_df["year"] = year
-    #     location_df["period"] = period
-    #     location_df["week"] = week
-    #     location_df["week_index"] = week_index
-    #     location_df["period_index"] = period_index
-    #     weekly_item_base_cost_df = pd.concat(
-    #         [weekly_item_base_cost_df, location_df], ignore_index=True
-    #     )
-    # # drop rows with missing base_uofm
-    # weekly_item_base_cost_df = weekly_item_base_cost_df.dropna(subset=["base_uofm"])
-
     # reorder columns
-    weekly_item_base_cost_df = weekly_item_base_cost_df[
-        [
-            "date",
-            "year",
-            "period",
-            "week",
-            "week_index",
-            "period_index",
-            "store_id",
-            "item",
-            "base_uofm",
-            "base_cost",
-            "item_id",
-        ]
-    ]
+    weekly_item_base_cost_df = weekly_item_base_cost_df[WEEKLY_BASE_COST_COLUMNS]
     # write to csv for debugging
     weekly_item_base_cost_df.to_csv("./output/weekly_item_base_cost.csv", index=False)
 
-    # upsert the date into the weekly_item_base_cost table
-    upsert_query = """
-        INSERT INTO weekly_item_base_cost (date, year, period, week, week_index, period_index, store_id, item, base_uofm, base_cost, item_id)
-        VALUES %s
-        ON CONFLICT (week_index, store_id, item) DO UPDATE SET
-            date = EXCLUDED.date,
-            year = EXCLUDED.year,
-            period = EXCLUDED.period,
-            week = EXCLUDED.week,
-            period_index = EXCLUDED.period_index,
-            base_uofm = EXCLUDED.base_uofm,
-            base_cost = EXCLUDED.base_cost,
-            item_id = EXCLUDED.item_id;
+    write_weekly_base_costs(db, weekly_item_base_cost_df)
+
+
+WEEKLY_BASE_COST_COLUMNS = [
+    "date",
+    "year",
+    "period",
+    "week",
+    "week_index",
+    "period_index",
+    "store_id",
+    "item",
+    "base_uofm",
+    "base_cost",
+    "item_id",
+]
+
+
+def write_weekly_base_costs(db, df):
+    """Stage rows with COPY and merge them into weekly_item_base_cost at once."""
+    merged = db.merge_frame(
+        df[WEEKLY_BASE_COST_COLUMNS],
+        "weekly_item_base_cost",
+        key=["week_index", "store_id", "item"],
+    )
+    print(f"Upserted {merged} rows into weekly_item_base_cost.")
+
+
+def get_weeks(cur, years):
+    """Week-ending calendar rows (dow = 7) for the given fiscal years."""
+    cur.execute(
+        """
+        SELECT date AS week_end, year, period, week, week_index, period_index
+        FROM calendar
+        WHERE year = ANY(%s) AND dow = 7
+        ORDER BY date
+        """,
+        (list(years),),
+    )
+    rows = cur.fetchall()
+    if not rows:
+        raise ValueError(f"No calendar entries found for years: {years}")
+    return pd.DataFrame(
+        rows,
+        columns=["week_end", "year", "period", "week", "week_index", "period_index"],
+    )
+
+
+def pair_filter(alias, pairs):
+    """
+    SQL condition and params limiting alias to the (store_id, item_id) pairs.
+
+    Item ids are R365 GUID strings, so they are passed as text.
+    """
+    if pairs is None:
+        return "", ()
+    condition = f"""
+          AND ({alias}.store_id, {alias}.item_id) IN (
+              SELECT * FROM unnest(%s::integer[], %s::text[])
+          )"""
+    return condition, (
+        pairs["store_id"].astype(int).tolist(),
+        pairs["item_id"].astype(str).tolist(),
+    )
+
+
+COST_HISTORY_COLUMNS = ["date", "store_id", "item_id", "item", "base_uofm", "base_cost"]
+
+
+def cost_history_frame(rows):
+    """
+    Purchase or stock count rows as a DataFrame with fixed key dtypes.
+
+    An empty result would otherwise come back all object columns, which
+    merge_asof refuses to match against the typed keys of the week grid.
+    """
+    df = pd.DataFrame(rows, columns=COST_HISTORY_COLUMNS)
+    df["date"] = pd.to_datetime(df["date"])
+    df["store_id"] = df["store_id"].astype("int64")
+    df["item_id"] = df["item_id"].astype(str)
+    df["base_cost"] = pd.to_numeric(df["base_cost"]).astype("float64")
+    return df
+
+
+def get_purchase_history(cur, end_date, pairs=None):
+    """
+    Every costed Food/LBW purchase up to end_date, one read of the history.
+
+    pairs, a DataFrame of store_id and item_id, limits the read to those pairs.
+    """
+    condition, pair_params = pair_filter("p", pairs)
+    cur.execute(
+        """
+        SELECT
+            p.date,
+            p.store_id,
+            p.item_id,
+            i.name AS item,
+            p.base_uofm,
+            CASE
+                WHEN p.quantity > 0 AND p.base_qty > 0
+                THEN (p.amount / p.quantity) / p.base_qty
+                ELSE 0
+            END AS base_cost
+        FROM purchases_pbi p
+        JOIN item i ON p.item_id = i.itemid
+        WHERE p.store_id IN (SELECT id FROM restaurants WHERE toast_id IS NOT NULL)
+          AND p.date <= %s
+          AND p.category1 IN ('Food', 'LBW'){condition}
+        """.format(condition=condition),
+        (end_date, *pair_params),
+    )
+    return cost_history_frame(cur.fetchall())
+
+
+def get_first_stock_counts(cur, end_date, pairs=None):
+    """Earliest stock count per (store_id, item_id) up to end_date, costed."""
+    condition, pair_params = pair_filter("scp", pairs)
+    cur.execute(
+        """
+        SELECT DISTINCT ON (scp.store_id, scp.item_id)
+            scp.date,
+            scp.store_id,
+            scp.item_id,
+            item.name AS item,
+            u.base_uofm,
+            CASE
+                WHEN scp.quantity > 0 AND u.base_qty > 0
+                THEN (scp.amount / scp.quantity) / u.base_qty
+                ELSE 0
+            END AS base_cost
+        FROM stock_count_pbi scp
+        JOIN item ON scp.item_id = item.itemid
+        LEFT JOIN unitsofmeasure u ON u.name = scp.uofm
+        WHERE scp.store_id IN (SELECT id FROM restaurants WHERE toast_id IS NOT NULL)
+          AND scp.date <= %s{condition}
+        ORDER BY scp.store_id, scp.item_id, scp.date ASC
+        """.format(condition=condition),
+        (end_date, *pair_params),
+    )
+    return cost_history_frame(cur.fetchall())
+
+
+def as_of_base_costs(purchases, first_counts, weeks, since=None):
+    """
+    Base cost of every (store_id, item_id) pair as of every week end.
+
+    Purchases are sorted once and matched to the week ends with merge_asof,
+    so each week picks up the latest purchase on or before its end date. As
+    in process_week, the pair's earliest stock count is used instead when
+    there is no purchase yet or the purchase has no cost, provided the count
+    falls on or before the week end.
+
+    since, a DataFrame of store_id, item_id and since, limits each pair to
+    the weeks ending on or after its since date.
     """
-    tuples = [
-        (
-            row["date"],
-            row["year"],
-            row["period"],
-            row["week"],
-            row["week_index"],
-            row["period_index"],
-            row["store_id"],
-            row["item"],
-            row["base_uofm"],
-            row["base_cost"],
-            row["item_id"],
+    keys = ["store_id", "item_id"]
+    purchases = purchases.assign(date=pd.to_datetime(purchases["date"]))
+    first_counts = first_counts.assign(date=pd.to_datetime(first_counts["date"]))
+    weeks = weeks.assign(week_end=pd.to_datetime(weeks["week_end"]))
+
+    # A pair enters the grid from the week of its first purchase or count
+    first_seen = (
+        pd.concat([purchases[keys + ["date"]], first_counts[keys + ["date"]]])
+        .groupby(keys, as_index=False)["date"]
+        .min()
+        .rename(columns={"date": "first_seen"})
+    )
+    grid = first_seen.merge(weeks, how="cross")
+    grid = grid[grid["week_end"] >= grid["first_seen"]].drop(columns="first_seen")
+    if since is not None:
+        since = since.assign(since=pd.to_datetime(since["since"]))
+        grid = grid.merge(since, on=keys)
+        grid = grid[grid["week_end"] >= grid["since"]].drop(columns="since")
+
+    costs = pd.merge_asof(
+        grid.sort_values("week_end"),
+        purchases.sort_values("date"),
+        left_on="week_end",
+        right_on="date",
+        by=keys,
+        direction="backward",
+    )
+    costs = costs.merge(first_counts, on=keys, how="left", suffixes=("", "_sc"))
+
+    has_count = costs["date_sc"].notna() & (costs["date_sc"] <= costs["week_end"])
+    use_count = has_count & (costs["date"].isna() | (costs["base_cost"] == 0))
+    for column in ["date", "item", "base_uofm", "base_cost"]:
+        costs[column] = costs[column].where(~use_count, costs[f"{column}_sc"])
+
+    costs = costs[costs["date"].notna()]
+    costs["date"] = costs["date"].dt.date
+    return costs[WEEKLY_BASE_COST_COLUMNS]
+
+
+def get_week_of(cur, day):
+    """Calendar year, period, week, week_index and week_end of the week containing day."""
+    cur.execute(
+        """
+        SELECT c.year, c.period, c.week, c.week_index, e.date AS week_end
+        FROM calendar c
+        JOIN calendar e ON e.week_index = c.week_index AND e.dow = 7
+        WHERE c.date = %s
+        """,
+        (day,),
+    )
+    result = cur.fetchone()
+    if not result:
+        raise ValueError(f"No calendar entry found for {day}")
+    return result
+
+
+def backfill(db, years):
+    """
+    Rebuild weekly_item_base_cost for every week of the given years at once.
+
+    Weeks after the current one are skipped: their costs would only be the
+    current ones carried forward, and --incremental never revisits them.
+    """
+    today = datetime.now().date()
+    current_week = get_week_of(db.cur, today - timedelta(days=1))
+    weeks = get_weeks(db.cur, years)
+    weeks = weeks[weeks["week_index"] <= current_week["week_index"]]
+    if weeks.empty:
+        print(f"No weeks of {years} have started yet")
+        return
+    last_week_end = weeks["week_end"].max()
+    print(f"Backfilling {len(weeks)} weeks through {last_week_end}")
+
+    purchases = get_purchase_history(db.cur, last_week_end)
+    first_counts = get_first_stock_counts(db.cur, last_week_end)
+    costs = as_of_base_costs(purchases, first_counts, weeks)
+    # drop rows with missing base_uofm
+    costs = costs.dropna(subset=["base_uofm"])
+
+    write_weekly_base_costs(db, costs)
+
+    # A backfill through the current week is a starting point for --incremental
+    if last_week_end == current_week["week_end"]:
+        write_last_run(today)
+
+
+def get_weeks_between(cur, start_date, end_date):
+    """Week-ending calendar rows for every week overlapping start_date..end_date."""
+    cur.execute(
+        """
+        SELECT date AS week_end, year, period, week, week_index, period_index
+        FROM calendar
+        WHERE dow = 7 AND date >= %s AND week_start <= %s
+        ORDER BY date
+        """,
+        (start_date, end_date),
+    )
+    return pd.DataFrame(
+        cur.fetchall(),
+        columns=["week_end", "year", "period", "week", "week_index", "period_index"],
+    )
+
+
+def get_last_stored_week_end(cur):
+    """End date of the latest week in weekly_item_base_cost, or None when empty."""
+    cur.execute(
+        """
+        SELECT date AS week_end
+        FROM calendar
+        WHERE dow = 7
+          AND week_index = (SELECT MAX(week_index) FROM weekly_item_base_cost)
+        """
+    )
+    result = cur.fetchone()
+    return result["week_end"] if result else None
+
+
+def has_week(cur, week_index):
+    cur.execute(
+        "SELECT 1 FROM weekly_item_base_cost WHERE week_index = %s LIMIT 1",
+        (week_index,),
+    )
+    return cur.fetchone() is not None
+
+
+def get_changed_pairs(cur, since):
+    """
+    (store_id, item_id) pairs with purchases or stock counts dated since.
+
+    Each pair comes back with the earliest such date; every week ending on
+    or after it may have a different base cost.
+    """
+    cur.execute(
+        """
+        SELECT store_id, item_id, MIN(date) AS since
+        FROM (
+            SELECT store_id, item_id, date
+            FROM purchases_pbi
+            WHERE date >= %(since)s AND category1 IN ('Food', 'LBW')
+            UNION ALL
+            SELECT store_id, item_id, date
+            FROM stock_count_pbi
+            WHERE date >= %(since)s
+        ) changes
+        WHERE store_id IN (SELECT id FROM restaurants WHERE toast_id IS NOT NULL)
+        GROUP BY store_id, item_id
+        """,
+        {"since": since},
+    )
+    return pd.DataFrame(cur.fetchall(), columns=["store_id", "item_id", "since"])
+
+
+def read_last_run():
+    try:
+        with open(Config.BASE_COST_STATE_FILE) as f:
+            return date.fromisoformat(json.load(f)["last_run"])
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
+
+
+def write_last_run(run_date):
+    with open(Config.BASE_COST_STATE_FILE, "w") as f:
+        json.dump({"last_run": run_date.isoformat()}, f)
+
+
+def incremental(db, lookback_days, since=None):
+    """
+    Recompute only the pairs that had purchases or stock counts since the
+    last run, for every week from the change through the current week, or
+    through the latest week already stored if that is later.
+
+    The first run of a new week seeds it in full with process_week, since
+    pairs without activity would otherwise have no row for it.
+
+    Activity is found by document date, looking back lookback_days before
+    the last run so late-posted invoices are still picked up. since, when
+    given, replaces the last run; with neither there is no safe starting
+    point, so the run stops rather than guess one.
+    """
+    today = datetime.now().date()
+    yesterday = today - timedelta(days=1)
+    if since is None:
+        last_run = read_last_run()
+        if last_run is None:
+            raise SystemExit(
+                f"No previous run recorded in {Config.BASE_COST_STATE_FILE}; "
+                "pass --since YYYY-MM-DD or run --backfill through the current week"
+            )
+        since = last_run - timedelta(days=lookback_days)
+
+    current_week = get_week_of(db.cur, yesterday)
+    if not has_week(db.cur, current_week["week_index"]):
+        print(f"Seeding week ending {current_week['week_end']} for every item")
+        process_week(
+            db, current_week["year"], current_week["period"], current_week["week"]
         )
-        for _, row in weekly_item_base_cost_df.iterrows()
-    ]
-    execute_values(db.cur, upsert_query, tuples)
-    db.conn.commit()
-    print("Data upserted into weekly_item_base_cost table successfully.")
+
+    changed = get_changed_pairs(db.cur, since)
+    if changed.empty:
+        print(f"No purchases or stock counts since {since}")
+        write_last_run(today)
+        return
+
+    # Weeks stored ahead of the current one hold carried-forward costs too
+    through = max(yesterday, get_last_stored_week_end(db.cur) or yesterday)
+    weeks = get_weeks_between(db.cur, changed["since"].min(), through)
+    if weeks.empty:
+        # Only activity dated after the weeks stored; the next run's lookback covers it
+        print(f"No weeks through {through} affected by activity since {since}")
+        write_last_run(today)
+        return
+    last_week_end = weeks["week_end"].max()
+    print(
+        f"{len(changed)} store/item pairs changed since {since}, "
+        f"recomputing {len(weeks)} weeks through {last_week_end}"
+    )
+
+    pairs = changed[["store_id", "item_id"]]
+    purchases = get_purchase_history(db.cur, last_week_end, pairs)
+    first_counts = get_first_stock_counts(db.cur, last_week_end, pairs)
+    costs = as_of_base_costs(purchases, first_counts, weeks, since=changed)
+    # drop rows with missing base_uofm
+    costs = costs.dropna(subset=["base_uofm"])
+
+    write_weekly_base_costs(db, costs)
+    write_last_run(today)
 
 
 def main():
@@ -393,35 +538,32 @@ def main():
         metavar="YEAR",
         help="Backfill all weeks for one or more years (e.g., --backfill 2023 2024)",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Recompute only items with purchases or stock counts since the last run",
+    )
+    parser.add_argument(
+        "--since",
+        type=date.fromisoformat,
+        help="With --incremental, scan activity from this date (YYYY-MM-DD) "
+        "instead of the last recorded run",
+    )
+    parser.add_argument(
+        "--lookback",
+        type=int,
+        default=7,
+        help="Days before the last run to scan for late-posted activity (default 7)",
+    )
     args = parser.parse_args()
 
     with DatabaseConnection() as db:
         if args.backfill:
-            query = """
-                SELECT DISTINCT year, period, week
-                FROM calendar
-                WHERE year = ANY(%s)
-                ORDER BY year, period, week
-            """
-            db.cur.execute(query, (args.backfill,))
-            weeks = db.cur.fetchall()
-            if not weeks:
-                raise ValueError(
-                    f"No calendar entries found for years: {args.backfill}"
-                )
-
-            for row in weeks:
-                year, period, week = row["year"], row["period"], row["week"]
-                print(f"\nProcessing year={year}, period={period}, week={week}...")
-                try:
-                    process_week(db, year, period, week)
-                except Exception as e:
-                    print(f"  ERROR: {e}")
-                    continue
+            backfill(db, args.backfill)
+        elif args.incremental:
+            incremental(db, args.lookback, args.since)
         else:
             if not args.year or not args.period or not args.week:
-                from datetime import datetime, timedelta
-
                 yesterday = datetime.now() - timedelta(days=1)
                 query = """
                     SELECT year, period, week